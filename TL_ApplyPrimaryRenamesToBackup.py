@@ -5,95 +5,143 @@
 #!/usr/bin/env python3
 import os
 import sys
-import re
 import shutil
-import hashlib
-from pathlib import Path
-import tkinter as tk
-from tkinter import filedialog
-
-def get_dt_patterns():
-
-    re1 = re.compile(r"^\d{4}-\d{2}-\d{2}[ _]\d{2}[-_]\d{2}[-_]\d{2}\.\d{3,6}[\+-]\d{4} "),
-    re2 = re.compile(r"^\d{4}-\d{2}-\d{2}[ _]\d{2}[-_]\d{2}[-_]\d{2}\.\d{3,6} "),
-    re3 = re.compile(r"^\d{4}-\d{2}-\d{2}[ _]\d{2}[-_]\d{2}[-_]\d{2}[\+-]\d{4} "),
-    re4 = re.compile(r"^\d{4}-\d{2}-\d{2}[ _]\d{2}[-_]\d{2}[-_]\d{2} "),
-    re5 = re.compile(r"^\d{4}-\d{2}-\d{2}[ _]\d{2}[-_]\d{2}[\+-]\d{4} "),
-    re6 = re.compile(r"^\d{4}-\d{2}-\d{2}[ _]\d{2}[-_]\d{2} ")
-    
-    return [re1, re2, re3, re4, re5, re6,]
+import argparse
+from tl_scan import scan_collection
+from tl_hashing import compute_partial_hash, DigestCache
+from tl_dtparse import get_datetime_prefix
+from tl_common import ask_volume_root, get_relpath_key, get_volume_path
+import tl_metrics
 
 def get_backup_root():
-    root = tk.Tk()
-    root.withdraw()  # Hide the main window
-    backup_root = filedialog.askdirectory(
-        title="Select Drive letter of Backup Collection"
-    )
-    root.destroy()
-    if backup_root and os.path.ismount(backup_root):
-        return backup_root
-    return None
+    return ask_volume_root("Select Drive letter of Backup Collection")
 
-def get_collection_files_shallow(root_path):
-    """Get all files in collection directories (excluding root files and _* root dirs)"""
-    root_path = Path(root_path)
-    files_to_copy = []
-    for item in root_path.iterdir():
-        if item.is_file():
-            continue
-        elif item.is_dir() and item.name.startswith('_'):
-            continue
-        elif item.is_dir() and item.name.startswith('System Volume'):
-            continue
-        else:
-            for root_dir, _, files in item.iterdir():
-                for file in files:
-                    files_to_copy.append(os.path.join(root_dir, file))
-    return files_to_copy
-
-def get_unique_filename(dest_path):
-    base, ext = os.path.splitext(dest_path)
-    counter = 1
-    while os.path.exists(dest_path):
-        dest_path = f"{base}_{counter}{ext}"
-        counter += 1
-    return dest_path
+def match_filename_substr(filename):
+    # a rename is only matched on a prefix with at least hours and minutes
+    return get_datetime_prefix(filename, require_minutes=True)
 
 # last thing TODO
-def calc_filename_substr(file_path, patterns):
-    # patterns are precompiled in main() before any loop
+def calc_filename_substr(file_path):
     parentpath, filename = os.path.split(file_path)
-    match_substr = ""
-    pattern_used = None
-    for pattern in patterns:
-        match_result = pattern.match(filename)
-        if match_result:
-            pattern_used = pattern
-            match_substr = match_result.group()
-            break
+    match_substr = match_filename_substr(filename)
     print(f" try match - filename: {filename}")
-    print(f" - with pattern: {pattern_used}")
     print(f" - match_substr: {match_substr}")
     return parentpath, filename, match_substr
 
-def compute_sha256(file_path):
-    sha256 = hashlib.sha256()
-    with open(file_path, 'rb') as f:
-        for chunk in iter(lambda: f.read(4096), b''):
-            sha256.update(chunk)
-    return sha256.hexdigest()
+def build_prefix_index(relative_paths):
+    """Index relative paths by (folder, datetime prefix of the filename)"""
+    prefix_index = {}
+    for relative_path in relative_paths:
+        folder, filename = os.path.split(relative_path)
+        match_substr = match_filename_substr(filename)
+        if match_substr == "":
+            continue
+        prefix_index.setdefault((folder, match_substr), []).append(relative_path)
+    return prefix_index
+
+def isIdentical(mbpath, pri_file_path, backup_cache, primary_cache):
+    # sha256 digests are cached on each volume, keyed by path, size and mtime
+    return backup_cache.sha256(mbpath) == primary_cache.sha256(pri_file_path)
+
+def match_by_content(primary_relpaths, backup_relpaths, primary_by_relpath, backup_by_relpath,
+                     primary_cache, backup_cache):
+    """Pair primary files with backup files of identical content, wherever they are.
+    For files moved to another folder, or whose datetime prefix changed.
+    Candidates are narrowed by size, then by a hash of the head and tail
+    blocks, and only confirmed with a full sha256.
+    Returns (primary relpath, backup relpath) pairs.
+    """
+    backup_by_size = {}
+    for relpath in backup_relpaths:
+        backup_by_size.setdefault(backup_by_relpath[relpath].size, []).append(relpath)
+
+    def partial_key(f, cache):
+        try:
+            return compute_partial_hash(f.path, io_limit=cache.io_limit)
+        except OSError:
+            return None
+
+    pairs = []
+    primary_by_size = {}
+    for relpath in primary_relpaths:
+        primary_by_size.setdefault(primary_by_relpath[relpath].size, []).append(relpath)
+    for size, size_primaries in primary_by_size.items():
+        size_backups = backup_by_size.get(size)
+        if not size_backups:
+            continue
+        backup_by_partial = {}
+        for relpath in size_backups:
+            key = partial_key(backup_by_relpath[relpath], backup_cache)
+            if key is not None:
+                backup_by_partial.setdefault(key, []).append(relpath)
+        for relpath in size_primaries:
+            pri_file = primary_by_relpath[relpath]
+            if not backup_by_partial:
+                break
+            candidates = backup_by_partial.get(partial_key(pri_file, primary_cache))
+            if not candidates:
+                continue
+            # identical content, so when several match any of them will do
+            for backup_relpath in candidates:
+                try:
+                    identical = isIdentical(backup_by_relpath[backup_relpath].path, pri_file.path,
+                                            backup_cache, primary_cache)
+                except OSError:
+                    continue
+                if identical:
+                    candidates.remove(backup_relpath)
+                    pairs.append((relpath, backup_relpath))
+                    break
+    return pairs
+
+def rename_backup_file(backup_root, backup_old_relpath, relative_path, backup_by_relpath,
+                       backup_cache, primary_cache, pri_file_path):
+    """Rename or move a backup file to the primary file's relative path.
+    Returns None if it was renamed, else why not.
+    """
+    backup_old_path = backup_by_relpath[backup_old_relpath].path
+    backup_eq_path = os.path.join(backup_root, relative_path)
+    try:
+        # the scan keys are exact case, but a card ignores case on any OS and
+        # a rename replaces an existing file without an error. one stat per
+        # rename. a target that is the file itself is a change of case only.
+        tl_metrics.count("fs_stat")
+        if os.path.lexists(backup_eq_path) and not os.path.samefile(backup_eq_path, backup_old_path):
+            return "a file with that name is already on the backup"
+        # a moved file's folder may not exist on the backup yet
+        tl_metrics.count("fs_makedirs")
+        os.makedirs(os.path.dirname(backup_eq_path), exist_ok=True)
+        tl_metrics.count("fs_rename")
+        os.rename(backup_old_path, backup_eq_path)
+    except OSError as e:
+        return str(e)
+    backup_by_relpath[relative_path] = backup_by_relpath.pop(backup_old_relpath)._replace(
+        relpath=relative_path, path=str(backup_eq_path))
+    # content is identical to primary, so carry the digest to the new path
+    backup_cache.remove(get_relpath_key(backup_old_path, backup_root))
+    backup_cache.store_file(backup_eq_path, sha256=primary_cache.sha256(pri_file_path))
+    return None
 
-def isIdentical(mbpath, pri_file_path):
-    return compute_sha256(mbpath) == compute_sha256(pri_file_path)
 
+def get_args():
+    parser = argparse.ArgumentParser(description="Rename backup files after their renamed primary files")
+    parser.add_argument("primary_root", help="root of the primary collection volume")
+    parser.add_argument("--backup", default=None,
+                        help="root of the backup volume (default: ask)")
+    parser.add_argument("--batch", action="store_true",
+                        help="never ask: needs --backup, for scheduled or scripted runs")
+    parser.add_argument("--profile", action="store_true",
+                        help="profile the run with cProfile, saved in the tools folder")
+    args = parser.parse_args()
+    if args.batch and not args.backup:
+        parser.error("--batch needs --backup")
+    return args
 
 def main():
-    if len(sys.argv) != 2:
-        print("Error: Primary root path not provided")
-        sys.exit(1)
+    args = get_args()
+    tl_metrics.start_run("apply_renames", args.profile)
     
-    primary_root_str = sys.argv[1] + "\\"
-    primary_root = Path(primary_root_str)
+    primary_root = get_volume_path(args.primary_root)
     
     if not primary_root.exists():
         print(f"Error: Primary root path does not exist: {primary_root}")
@@ -101,13 +149,13 @@ def main():
     
     print(f"Primary SD card root: {primary_root}")
     
-    # Get backup root from user
-    backup_root_str = get_backup_root()
+    # Get backup root from the arguments or the user
+    backup_root_str = args.backup or get_backup_root()
     if not backup_root_str:
         print("No backup root selected. Exiting.")
         sys.exit(1)
     
-    backup_root = Path(backup_root_str)
+    backup_root = get_volume_path(backup_root_str)
     print(f"Backup SD card root: {backup_root}")
     
     if not backup_root.exists():
@@ -116,88 +164,145 @@ def main():
 
     # Get collection files from both roots
     print("Scanning primary collection...")
-    primary_files = get_collection_files_shallow(primary_root)
+    with tl_metrics.phase("scan"):
+        primary_files = list(scan_collection(primary_root))
     num_primary_files = len(primary_files)
     print(f" Primary collection: {num_primary_files} files.")
 
     # Get collection files from both roots
     print("Scanning backup collection...")
-    backup_files = get_collection_files_shallow(backup_root)
+    with tl_metrics.phase("scan"):
+        backup_files = list(scan_collection(backup_root))
     num_backup_files = len(backup_files)
     print(f" Backup collection: {num_backup_files} files.")
 
     # match ok 2008-04-13_15-42 TH Chiang Mai Songkran water fight drummer - RENAME.mp4
     # match fail 2008-04-12_12-17-56+0700 TH Chiang Mai_RENAME.jpg
-    datetime_patterns = get_dt_patterns()
+    primary_cache = DigestCache(primary_root)
+    backup_cache = DigestCache(backup_root)
     # rename files in backup difft from primary if match
-    checked = 0
-    count_same = 0
     count_undet = 0
     count_renamed = 0
+    count_moved = 0
+    # primary files not matched by their datetime prefix, tried again by content
+    leftover_relpaths = []
+    undetermined_relpaths = set()
     errors = 0
     errors_list = []
 
+    # relative paths present on both sides need no work.
+    # only primary paths missing from backup can be renames,
+    # only backup paths missing from primary can be their old names.
+    primary_by_relpath = {f.relpath: f for f in primary_files}
+    backup_by_relpath = {f.relpath: f for f in backup_files}
+    unmatched_relpaths = [f.relpath for f in primary_files if f.relpath not in backup_by_relpath]
+    orphan_backup_relpaths = [f.relpath for f in backup_files if f.relpath not in primary_by_relpath]
+    count_same = num_primary_files - len(unmatched_relpaths)
+    checked = count_same
+    prefix_index = build_prefix_index(orphan_backup_relpaths)
+
     #print(f" → 0 / {num_primary_files}, 0 same, 0 undetermined, 0 renamed, 0 errors", end="\r")
 
-    for pri_file_path in primary_files:
+    for relative_path in unmatched_relpaths:
 
         checked += 1
-        relative_path = os.path.relpath(pri_file_path, primary_root)
+        pri_file_path = os.path.join(primary_root, relative_path)
         backup_eq_path = backup_root / relative_path
 
-        #if backup_eq_path in backup_files:
-        if backup_eq_path.exists():
-            count_same += 1
-            continue # filename exists in backup
-
         # ONLY RENAMED FILES FROM HERE
         print(f"   ")
         print(f" primary file: {pri_file_path}")
         print(f" relative_path: {relative_path}")
         print(f" backup_eq_path: {backup_eq_path}")
 
-        parentpath, filename, f_substr = calc_filename_substr(pri_file_path, datetime_patterns)
+        parentpath, filename, f_substr = calc_filename_substr(pri_file_path)
 
         if f_substr == "":
-            count_undet += 1
+            undetermined_relpaths.add(relative_path)
+            leftover_relpaths.append(relative_path)
             continue # insufficient filename
 
         b_parentpath, filename = os.path.split(backup_eq_path)
-        backup_path_substr = os.path.join(b_parentpath, f_substr)
-        print(f" backup_path_substr: {backup_path_substr}")
+        prefix_key = (os.path.dirname(relative_path), f_substr)
+        print(f" backup_path_substr: {os.path.join(b_parentpath, f_substr)}")
         
-        # check how many files have that filename prefix. 
-        matching_paths = [bpath for bpath in backup_files if bpath.startswith(backup_path_substr)]
-        print(f" num matching: {len(matching_paths)}")
+        # backup files in the same folder with that filename prefix.
+        matching_relpaths = prefix_index.get(prefix_key, [])
+        print(f" num matching: {len(matching_relpaths)}")
+        # a different size can not be identical, so skip hashing those.
+        # sizes are from the scan, no stat needed.
+        pri_size = primary_by_relpath[relative_path].size
+        matching_paths = [backup_by_relpath[r].path for r in matching_relpaths
+                          if backup_by_relpath[r].size == pri_size]
         # possible theres multiple dt matches
-        ident_matching_paths = [mbpath for mbpath in matching_paths if isIdentical(mbpath, pri_file_path)]
+        with tl_metrics.phase("hash"):
+            ident_matching_paths = [mbpath for mbpath in matching_paths if isIdentical(mbpath, pri_file_path, backup_cache, primary_cache)]
         print(f" num identical file: {len(ident_matching_paths)}")
         
         # only proceed if theres one otherwise its too messy
         if len(ident_matching_paths) == 1:
             #rename with primary
             backup_old_path = ident_matching_paths[0]
-            os.rename(backup_old_path, backup_eq_path)
-            if backup_eq_path.exists():
+            backup_old_relpath = os.path.relpath(backup_old_path, backup_root)
+            failure = rename_backup_file(backup_root, backup_old_relpath, relative_path, backup_by_relpath,
+                                         backup_cache, primary_cache, pri_file_path)
+            if failure is None:
                 count_renamed += 1
+                # no longer a candidate for other primary files
+                matching_relpaths.remove(backup_old_relpath)
                 print(f" Renamed: {backup_old_path} with {filename}")
             else:
-                msg = f"Error: Backup file not renamed: {backup_old_path}"
+                msg = f"Error: Backup file not renamed: {backup_old_path} to {filename} ({failure})"
                 errors_list.append(msg)
                 errors += 1
         else:
-            msg = f"Error: No exact file match: {backup_eq_path}"
-            errors_list.append(msg)
-            errors += 1
+            leftover_relpaths.append(relative_path)
                 
         #if checked % 10 == 0:
         #    print(f" → {checked} / {num_primary_files}, {count_same} same, {count_undet} undetermined, {count_renamed} renamed, {errors} errors", end="\r")
 
     #print(f" ✓ {checked} / {num_primary_files}, {count_same} same, {count_undet} undetermined, {count_renamed} renamed, {errors} errors", end="\r")
+
+    # files moved to another folder, or with a corrected datetime prefix, are
+    # found by content among the backup files still without a primary file.
+    # a rename on the backup instead of a full copy by the copy tool.
+    orphan_backup_relpaths = [r for r in orphan_backup_relpaths if r in backup_by_relpath]
+    print(f"\nMatching {len(leftover_relpaths)} primary files by content, against {len(orphan_backup_relpaths)} backup files...")
+    with tl_metrics.phase("content match"):
+        pairs = match_by_content(leftover_relpaths, orphan_backup_relpaths, primary_by_relpath,
+                                 backup_by_relpath, primary_cache, backup_cache)
+    moved_relpaths = set()
+    for relative_path, backup_old_relpath in pairs:
+        pri_file_path = primary_by_relpath[relative_path].path
+        failure = rename_backup_file(backup_root, backup_old_relpath, relative_path, backup_by_relpath,
+                                     backup_cache, primary_cache, pri_file_path)
+        if failure is None:
+            count_moved += 1
+            moved_relpaths.add(relative_path)
+            print(f" Moved: {backup_old_relpath} → {relative_path}")
+        else:
+            errors_list.append(f"Error: Backup file not moved: {os.path.join(backup_root, backup_old_relpath)}"
+                               f" to {relative_path} ({failure})")
+            errors += 1
+
+    for relative_path in leftover_relpaths:
+        if relative_path in moved_relpaths:
+            continue
+        if relative_path in undetermined_relpaths:
+            count_undet += 1
+        else:
+            errors_list.append(f"Error: No exact file match: {backup_root / relative_path}")
+            errors += 1
+    primary_cache.close()
+    backup_cache.close()
     print("")
-    print(f"\nOperation complete. Renamed {count_renamed} backup files after primary.")
+    print(f"\nOperation complete. Renamed {count_renamed} and moved {count_moved} backup files after primary.")
+    tl_metrics.finish_run(primary_root, {"files": num_primary_files, "same": count_same,
+                                         "undetermined": count_undet, "renamed": count_renamed,
+                                         "moved": count_moved, "errors": errors})
 
 if __name__ == "__main__":
     print("COLLECTION TOOL: Propagate primary file renames to backup")
     print("- if unique match found by datetime prefix is identical file")
+    print("- else if an identical file is found anywhere in the backup, by content")
     main()
\ No newline at end of file
@@ -0,0 +1,283 @@
+# TIMELINE TOOL - benchmark the collection tools on generated collections
+# - generates a timeline collection of each size, then times
+#   scan, hash, copy/verify, rename propagation, F-R rename and journal
+# - results are saved as json, to compare runs over time
+
+# 20261018 created
+
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import contextlib
+from datetime import datetime, timedelta
+from tl_scan import scan_collection
+from tl_dtparse import get_datetime_prefix
+import tl_hashing
+import tl_metrics
+
+STAGES = ["scan", "hash", "copy", "rename", "fr", "journal"]
+
+LOCATIONS = ["TH Chiang Mai", "TH Bangkok", "NZ Auckland", "NZ Wellington", "AU Sydney", "JP Kyoto", "home"]
+DESCRIPTIONS = ["market", "beach walk", "songkran water fight", "harbour ferry", "temple", "dinner", "birthday", "train"]
+OFFSETS = ["+0700", "+1200", "+1300", "+1000", "+0900", ""]
+EXTENSIONS = [(".jpg", 60), (".mp4", 15), (".png", 10), (".mov", 5), (".pdf", 5), (".txt", 5)]
+
+def pick_size(rng, max_size):
+    # mostly photo sized files, some videos, a few very large ones
+    roll = rng.random()
+    if roll < 0.95:
+        low, high = 4 * 1024, 1024 * 1024
+    elif roll < 0.995:
+        low, high = 1024 * 1024, 16 * 1024 * 1024
+    else:
+        low, high = 16 * 1024 * 1024, max_size
+    high = max(low, min(high, max_size))
+    return int(low * (high / low) ** rng.random())
+
+def make_filename(rng, when):
+    ext = rng.choices([e for e, _ in EXTENSIONS], [w for _, w in EXTENSIONS])[0]
+    description = rng.choice(DESCRIPTIONS)
+    if rng.random() < 0.05:
+        description += "_RENAME"
+    return f"{when:%Y-%m-%d_%H-%M-%S}{rng.choice(OFFSETS)} {rng.choice(LOCATIONS)} - {description}{ext}"
+
+def write_sparse_file(file_path, size, rng):
+    # a random head keeps every file distinct, the rest is a sparse hole
+    with open(file_path, "wb") as f:
+        f.write(rng.randbytes(min(size, 4096)))
+        f.truncate(size)
+
+def generate_collection(root, num_files, max_size, seed):
+    """Generate a timeline collection of num_files files under root.
+    Returns the folder names and the total bytes.
+    """
+    rng = random.Random(seed)
+    num_folders = max(3, num_files // 2000)
+    folders = [f"TIMELINE FOLDER {i + 1}" for i in range(num_folders)]
+    for folder in folders:
+        os.makedirs(os.path.join(root, folder), exist_ok=True)
+
+    # decoys the scanners should skip
+    for decoy in ["_Decoy", "System Volume Information"]:
+        os.makedirs(os.path.join(root, decoy), exist_ok=True)
+        for i in range(10):
+            write_sparse_file(os.path.join(root, decoy, f"2020-01-01_00-00-{i:02} decoy.jpg"), 4096, rng)
+
+    total_bytes = 0
+    when = datetime(2005, 1, 1)
+    for i in range(num_files):
+        when += timedelta(seconds=rng.randint(1, 20000))
+        folder = folders[i * num_folders // num_files]
+        size = pick_size(rng, max_size)
+        write_sparse_file(os.path.join(root, folder, make_filename(rng, when)), size, rng)
+        total_bytes += size
+        if i % 100 == 0:
+            print(f" → generating {i} / {num_files}", end="\r")
+    print(f" ✓ generated {num_files} files, {total_bytes / 1e6:.0f} MB")
+    return folders, total_bytes
+
+def rename_some_files(root, fraction, seed):
+    """Rename a fraction of the primary files, keeping the datetime prefix"""
+    rng = random.Random(seed)
+    renamed = 0
+    for collection_file in list(scan_collection(root)):
+        if rng.random() >= fraction:
+            continue
+        folder, filename = os.path.split(collection_file.path)
+        prefix = get_datetime_prefix(filename, require_minutes=True)
+        if not prefix:
+            continue
+        new_name = prefix + "renamed " + filename[len(prefix):]
+        os.rename(collection_file.path, os.path.join(folder, new_name))
+        renamed += 1
+    return renamed
+
+def make_fr_rules(folders):
+    rules = [
+        {"case_sens": True, "regex": False, "find": "_RENAME", "replace": ""},
+        {"case_sens": True, "regex": False, "find": "--", "replace": "-"},
+        {"case_sens": False, "regex": True, "find": "songkran (?P<what>\\w+)", "replace": "Songkran \\g<what>"},
+    ]
+    # compile_rule replaces "find" in place, so each folder gets its own copies
+    return {folder: [dict(rule) for rule in rules] for folder in folders}
+
+@contextlib.contextmanager
+def quiet_stdout(verbose):
+    if verbose:
+        yield
+        return
+    with open(os.devnull, "w", encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+def run_script_main(module, argv, replacements):
+    """Run a script's main() with argv, replacing its interactive prompts"""
+    saved_argv = sys.argv
+    saved = {name: getattr(module, name) for name in replacements}
+    sys.argv = [module.__file__] + argv
+    for name, value in replacements.items():
+        setattr(module, name, value)
+    try:
+        module.main()
+    finally:
+        sys.argv = saved_argv
+        for name, value in saved.items():
+            setattr(module, name, value)
+
+def time_stage(results, stage, func, num_files, num_bytes, verbose):
+    print(f" {stage}...", end="\r")
+    # the scripts start their own run, the library stages use this one
+    tl_metrics.start_run(stage)
+    start = time.perf_counter()
+    error = None
+    try:
+        with quiet_stdout(verbose):
+            func()
+    except SystemExit as e:
+        error = f"exit {e.code}"
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    seconds = time.perf_counter() - start
+    result = {
+        "seconds": round(seconds, 3),
+        "files_per_s": round(num_files / seconds, 1) if seconds else None,
+        "mb_per_s": round(num_bytes / 1e6 / seconds, 2) if seconds and num_bytes else None,
+    }
+    result["metrics"] = tl_metrics.current.summary()
+    if error:
+        result["error"] = error
+    results[stage] = result
+    rate = f", {result['mb_per_s']} MB/s" if result["mb_per_s"] else ""
+    print(f" {stage}: {seconds:.2f}s, {result['files_per_s']} files/s{rate}" + (f" ERROR {error}" if error else ""))
+
+def benchmark_size(work_dir, num_files, args):
+    import TL_CopyPrimaryToBackup as copy_script
+    import TL_ApplyPrimaryRenamesToBackup as apply_script
+    import TL_FilenameFR_BySets as fr_script
+    import TL_GenerateJsonlEntries as journal_script
+
+    run_dir = os.path.join(work_dir, f"bench_{num_files}")
+    if os.path.exists(run_dir):
+        shutil.rmtree(run_dir)
+    primary_root = os.path.join(run_dir, "primary")
+    backup_root = os.path.join(run_dir, "backup")
+    os.makedirs(backup_root)
+    print(f"\n{num_files} files:")
+    folders, total_bytes = generate_collection(primary_root, num_files, args.max_size_mb * 1024 * 1024, args.seed)
+
+    stages = {}
+    verbose = args.verbose
+
+    def do_scan():
+        list(scan_collection(primary_root))
+
+    def do_hash():
+        for collection_file in scan_collection(primary_root):
+            tl_hashing.compute_digests(collection_file.path)
+
+    def do_copy():
+        # fixed chunk sizes, so the stage times the copy and not the write probe
+        run_script_main(copy_script, [primary_root, "--full", "--buffer-kb", "1024", "--write-kb", "1024"], {
+            "get_backup_root": lambda: backup_root,
+            "get_comparison_mode": lambda: "sha256",
+        })
+
+    def do_rename():
+        run_script_main(apply_script, [primary_root], {"get_backup_root": lambda: backup_root})
+
+    def do_fr():
+        compiled, _ = fr_script.precompile_data_dict(make_fr_rules(folders))
+        fr_script.rename_files(primary_root, compiled)
+        fr_script.undo_queue.clear()
+
+    def do_journal():
+        run_script_main(journal_script, [primary_root, "--full"], {})
+
+    if "scan" in args.stages:
+        time_stage(stages, "scan", do_scan, num_files, 0, verbose)
+    if "hash" in args.stages:
+        time_stage(stages, "hash", do_hash, num_files, total_bytes, verbose)
+    if "copy" in args.stages:
+        time_stage(stages, "copy", do_copy, num_files, total_bytes, verbose)
+    if "rename" in args.stages:
+        if "copy" not in args.stages:
+            with quiet_stdout(verbose):
+                do_copy()
+        num_renamed = rename_some_files(primary_root, 0.1, args.seed)
+        time_stage(stages, "rename", do_rename, num_renamed, 0, verbose)
+    if "fr" in args.stages:
+        time_stage(stages, "fr", do_fr, num_files, 0, verbose)
+    if "journal" in args.stages:
+        time_stage(stages, "journal", do_journal, num_files, 0, verbose)
+
+    if not args.keep:
+        shutil.rmtree(run_dir, ignore_errors=True)
+    return {"num_files": num_files, "total_bytes": total_bytes, "stages": stages}
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Benchmark the timeline tools on generated collections")
+    parser.add_argument("work_dir", help="folder for the generated collections, on the device to test")
+    parser.add_argument("--sizes", default="1000,10000,100000",
+                        help="comma separated collection sizes in files (default: %(default)s)")
+    parser.add_argument("--stages", default=",".join(STAGES),
+                        help="comma separated stages to time (default: %(default)s)")
+    parser.add_argument("--max-size-mb", type=int, default=64,
+                        help="largest generated file. the copy stage writes every byte (default: %(default)s)")
+    parser.add_argument("--throttle-mbps", type=float, default=0,
+                        help="limit hash / copy io to this many MB/s, to mimic a slow card (default: off)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default=None,
+                        help="results json file (default: benchmark_results.json in work_dir)")
+    parser.add_argument("--keep", action="store_true", help="keep the generated collections")
+    parser.add_argument("--verbose", action="store_true", help="show the output of the tools")
+    args = parser.parse_args()
+    args.sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    args.stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = [s for s in args.stages if s not in STAGES]
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(unknown)}. choose from {', '.join(STAGES)}")
+    return args
+
+def main():
+    args = get_args()
+    work_dir = os.path.abspath(args.work_dir)
+    os.makedirs(work_dir, exist_ok=True)
+    tl_hashing.set_io_throttle(args.throttle_mbps)
+    if args.throttle_mbps:
+        print(f"IO throttled to {args.throttle_mbps} MB/s")
+
+    runs = []
+    for num_files in args.sizes:
+        runs.append(benchmark_size(work_dir, num_files, args))
+
+    results = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "throttle_mbps": args.throttle_mbps,
+        "max_size_mb": args.max_size_mb,
+        "seed": args.seed,
+        "runs": runs,
+    }
+    output_path = args.output or os.path.join(work_dir, "benchmark_results.json")
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults saved: {output_path}")
+
+    # a failed stage's time means nothing, make sure it is not missed
+    failed = [f"{run['num_files']} files {stage}: {result['error']}"
+              for run in runs for stage, result in run["stages"].items() if "error" in result]
+    if failed:
+        print(f"\nERROR: {len(failed)} stages failed, their times are not valid:")
+        for failure in failed:
+            print(f" {failure}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    print("COLLECTION TOOL: Benchmark")
+    main()
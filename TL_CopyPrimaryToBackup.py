@@ -1,3 +1,7 @@
+# 20261018 folder signature is a hash of every file's name, size and mtime, not the dir mtime
+# 20261018 --batch runs without dialogs or prompts, backups and mode from the arguments
+# 20261018 several backups in one run, each source file read once for all of them
+# 20261018 sample comparison mode, a few MB per file
 # 20250813 untested draft
 
 #!/usr/bin/env python3
@@ -5,58 +9,40 @@ import os
 import sys
 import shutil
 import hashlib
-import xxhash
+import argparse
+import threading
+from collections import deque
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-import tkinter as tk
-from tkinter import filedialog
+from tl_common import load_tools_json, save_tools_json, remove_tools_file, ask_volume_root, get_volume_path
+from tl_scan import list_collection_folders, scan_folder, FolderNamespace
+from tl_hashing import compute_digests, compute_sample_hash, copy_file_to_many, sync_files, set_read_buffer_size, set_write_chunk_size, DigestCache
+from tl_ioprobe import get_chunk_size, probe_read, probe_write
+import tl_metrics
+
+COMPARISON_MODES = ["size", "sample", "xxhash", "sha256"]
 
 def get_backup_root():
-    root = tk.Tk()
-    root.withdraw()  # Hide the main window
-    backup_root = filedialog.askdirectory(
-        title="Select Drive letter of Backup Collection"
-    )
-    root.destroy()
-    if backup_root and os.path.ismount(backup_root):
-        return backup_root
-    return None
+    return ask_volume_root("Select Drive letter of Backup Collection")
 
 def get_comparison_mode():
     print(f" COMPARISON MODE for files present in destination")
     print(f" - fast - by filesize (enter nothing)")
-    print(f" - medium - by xxhash (enter any char)")
+    print(f" - quick - by filesize and sampled blocks, a few MB per file (enter s)")
+    print(f" - medium - by xxhash (enter any other char)")
     print(f" - slow - by sha256 (enter any 2 chars)")
     user_input = input(" Enter response: ")
     if user_input == "":
         accuracy = "size"
+    elif user_input.lower() == "s":
+        accuracy = "sample"
     elif len(user_input) == 1:
         accuracy = "xxhash"
     else:
         accuracy = "sha256"
     return accuracy
 
-def get_collection_files_shallow(root_path):
-    """Get all files in collection directories (excluding root files and _* root dirs)"""
-    root_path = Path(root_path)
-    files_to_copy = []
-    
-    # Get all items in root
-    for item in root_path.iterdir():
-        if item.is_file():
-            # Skip files in root
-            continue
-        elif item.is_dir() and item.name.startswith('_'):
-            # Skip directories starting with underscore in root
-            continue
-        else:
-            # This is a collection directory - get all files recursively
-            
-            for root_dir, _, files in item.iterdir():
-                for file in files:
-                    files_to_copy.append(os.path.join(root_dir, file))
-    
-    return files_to_copy
-
 def move_file_preserving_structure(src_file, dest_root, relative_path):
     """Move file to destination while preserving directory structure"""
     dest_file = dest_root / relative_path
@@ -68,25 +54,31 @@ def move_file_preserving_structure(src_file, dest_root, relative_path):
     shutil.move(str(src_file), str(dest_file))
     print(f"Moved: {relative_path}")
 
-def compute_sha256(file_path):
-    sha256 = hashlib.sha256()
-    with open(file_path, 'rb') as f:
-        for chunk in iter(lambda: f.read(4096), b''):
-            sha256.update(chunk)
-    return sha256.hexdigest()
-
-def compute_xxhash(file_path):
-    with open(file_path, 'rb') as f:
-        return xxhash.xxh64(f.read()).hexdigest()
-
-def are_files_same(src_file, sha256_src, dest_file, accuracy):
+def are_files_same(src_file, dest_file, accuracy, src_cache, dest_cache):
+    # digests come from the on-volume caches while size and mtime are unchanged.
+    # a missing entry costs one read of the file, for both digests.
+    tl_metrics.count("fs_stat", 2)
     if Path(src_file).stat().st_size != Path(dest_file).stat().st_size:
         return False
     if accuracy == "size": return True
-    if compute_xxhash(src_file) != compute_xxhash(dest_file):
+    if accuracy == "sample":
+        # cached xxhashes on both sides are free, and better than samples
+        _, xxh_src = src_cache.cached(src_file)
+        _, xxh_dest = dest_cache.cached(dest_file)
+        if xxh_src is not None and xxh_dest is not None:
+            return xxh_src == xxh_dest
+        # samples cost a few MB whatever the size. they can only show a
+        # difference, and a difference makes the backup file a conflict that
+        # is renamed aside, so it is confirmed with full digests first.
+        if compute_sample_hash(src_file, src_cache.io_limit) == compute_sample_hash(dest_file, dest_cache.io_limit):
+            return True
+        tl_metrics.count("sample_escalations")
+    sha256_src, xxh_src = src_cache.digests(src_file)
+    sha256_dest, xxh_dest = dest_cache.digests(dest_file)
+    if xxh_src != xxh_dest:
         return False
     if accuracy == "xxhash": return True # is xxhash fast enough
-    if sha256_src != compute_sha256(dest_file):
+    if sha256_src != sha256_dest:
         return False
     return True
 
@@ -94,58 +86,443 @@ def are_files_same(src_file, sha256_src, dest_file, accuracy):
 #def get_mtime(file_path):
 #    return file_path.stat().st_mtime
 
+# conflict renames in the destination are serialised across copy workers.
+# each backup folder is listed once, on its first conflict, and the names
+# the plan will copy into it are added, so no rename can take one of them.
+dest_rename_lock = threading.Lock()
+dest_namespaces = {}
+planned_dest_names = {}
+
 def get_unique_filename(dest_path):
-    base, ext = os.path.splitext(dest_path)
-    counter = 1
-    while os.path.exists(dest_path):
-        dest_path = f"{base}_diff_{counter}{ext}"
-        counter += 1
-    return dest_path
-
-def copy_and_verify_file(src_file, dest_dir, relative_path, accuracy):
+    """Free _diff_N name for moving dest_path aside. Call with dest_rename_lock held"""
+    dest_folder, filename = os.path.split(dest_path)
+    namespace = dest_namespaces.get(dest_folder)
+    if namespace is None:
+        tl_metrics.count("fs_scandir")
+        namespace = FolderNamespace(dest_folder, os.listdir(dest_folder) + planned_dest_names.get(dest_folder, []))
+        dest_namespaces[dest_folder] = namespace
+    unique_name = namespace.unique_name(filename, "_diff_")
+    namespace.add(unique_name)
+    return os.path.join(dest_folder, unique_name)
+
+def format_copy_error(e, src_file):
+    if isinstance(e, OSError) and e.errno == 28:
+        return f"Error: Disk full, current SrcFile: {src_file}"
+    return f"Error: {str(e).split(':')[0]}, current SrcFile: {src_file}"
+
+def plan_file(src, dest_dir, accuracy, src_cache, dest_cache):
+    """Plan entry for one primary file. action is one of
+    copy - not in the backup
+    same - backup file is the same, nothing to do
+    conflict - backup file differs, it is renamed then the primary copied
+    error - could not be compared, message says why
+    """
+    entry = {"relpath": src.relpath, "size": src.size, "action": "copy"}
+    dest_file = os.path.join(dest_dir, src.relpath)
     try:
-        dest_renamed = False
-        dest_file = os.path.join(dest_dir, relative_path)
-        os.makedirs(os.path.dirname(dest_file), exist_ok=True)
+        tl_metrics.count("fs_stat")
+        dest_stat = os.stat(dest_file)
+    except FileNotFoundError:
+        return entry
+    try:
+        with tl_metrics.phase("worker.compare"):
+            same = are_files_same(src.path, dest_file, accuracy, src_cache, dest_cache)
+        if same:
+            entry["action"] = "same"
+        else:
+            entry["action"] = "conflict"
+            # identifies the planned file if the run is resumed after it was renamed
+            entry["dest_size"] = dest_stat.st_size
+            entry["dest_mtime_ns"] = dest_stat.st_mtime_ns
+    except (OSError, IOError) as e:
+        entry["action"] = "error"
+        entry["message"] = format_copy_error(e, src.path)
+    return entry
 
-        sha256_src = compute_sha256(src_file)
-        
-        if os.path.exists(dest_file):
+def is_planned_conflict(dest_file, entry):
+    """True if dest_file is still the differing file found when planning"""
+    try:
+        tl_metrics.count("fs_stat")
+        dest_stat = os.stat(dest_file)
+    except FileNotFoundError:
+        return False
+    return dest_stat.st_size == entry["dest_size"] and dest_stat.st_mtime_ns == entry["dest_mtime_ns"]
+
+def prepare_dest(dest_dir, entry, src_file):
+    """Make the dest folder, and move a planned conflict aside.
+    Returns (dest_file, None) or (dest_file, error message)
+    """
+    dest_file = os.path.join(dest_dir, entry["relpath"])
+    try:
+        tl_metrics.count("fs_makedirs")
+        os.makedirs(os.path.dirname(dest_file), exist_ok=True)
+    except OSError as e:
+        return dest_file, format_copy_error(e, src_file)
 
-            isSame = are_files_same(src_file, sha256_src, dest_file, accuracy)
-            if isSame:
-                return True, "same"
-            #rename non identical existing dest file
+    # after a resume the conflict may already be renamed, then
+    # any file at dest is an unfinished copy and is overwritten
+    if entry["action"] == "conflict" and is_planned_conflict(dest_file, entry):
+        #rename non identical existing dest file
+        with dest_rename_lock:
             dest_file_renamed = get_unique_filename(dest_file)
-            shutil.move(dest_file, dest_file_renamed) 
-            if not os.path.exists(dest_file_renamed):
-               return False, f"Error: Move non-identical dest file failed, - SrcFile: {src_file}"
-            dest_renamed = True        
-            
-        shutil.copy2(src_file, dest_file)
-
-        isSame = are_files_same(src_file, sha256_src, dest_file, "sha256")
-        if isSame:
-            if dest_renamed:
+            try:
+                tl_metrics.count("fs_rename")
+                shutil.move(dest_file, dest_file_renamed) 
+            except OSError:
+                return dest_file, f"Error: Move non-identical dest file failed, - SrcFile: {src_file}"
+    return dest_file, None
+
+def verify_copy(src_file, dest_file, sha256_src, xxh_src, target, entry):
+    """Check one written copy against the source digests"""
+    try:
+        # one read back of the written file, never from the cache
+        with tl_metrics.phase("worker.verify"):
+            sha256_dest, xxh_dest = compute_digests(dest_file, target.cache.io_limit)
+        if sha256_dest == sha256_src and xxh_dest == xxh_src:
+            target.cache.store_file(dest_file, sha256_dest, xxh_dest)
+            if entry["action"] == "conflict":
                 return True, "renamed"
             else:
                 return True, "copied"
         else:
+            tl_metrics.count("fs_remove")
             os.remove(dest_file)
             return False, f"Error: Copy Verification failed, dest deleted - SrcFile: {src_file}"
+    except (OSError, IOError) as e:
+        return False, format_copy_error(e, src_file)
 
+def copy_and_verify_file(src_file, src_cache, target_jobs):
+    """Carry out the copy or conflict plan entries of one source file.
+    target_jobs is a (backup target, plan entry) per backup that needs the file.
+    The source is read and hashed once, written to all of them together,
+    then each copy is verified on its own.
+    Returns a (success, status message) per job.
+    """
+    results = [None] * len(target_jobs)
+    open_jobs = []
+    dest_files = []
+    for i, (target, entry) in enumerate(target_jobs):
+        dest_file, error = prepare_dest(target.root, entry, src_file)
+        if error:
+            results[i] = (False, error)
+        else:
+            open_jobs.append(i)
+            dest_files.append(dest_file)
+    if not open_jobs:
+        return results
+
+    # source is read once, hashed while it is written.
+    # copies are not synced here, the worker would wait on the card for
+    # each one. BackupTarget.record syncs them a folder at a time.
+    try:
+        with tl_metrics.phase("worker.copy"):
+            sha256_src, xxh_src, failures = copy_file_to_many(
+                src_file, dest_files, src_cache.io_limit,
+                [target_jobs[i][0].cache.io_limit for i in open_jobs], fsync=False)
+        # digests of a partly read source are not the file's, never cache them
+        if sha256_src is not None:
+            src_cache.store_file(src_file, sha256_src, xxh_src)
     except (OSError, IOError) as e:
-        if isinstance(e, OSError) and e.errno == 28:
-            return False, f"Error: Disk full, current SrcFile: {src_file}"
-        return False, f"Error: {str(e).split(':')[0]}, current SrcFile: {src_file}"
+        # the source could not be read, no copy is complete
+        for i in open_jobs:
+            results[i] = (False, format_copy_error(e, src_file))
+        return results
+
+    for n, i in enumerate(open_jobs):
+        if n in failures:
+            results[i] = (False, format_copy_error(failures[n], src_file))
+        else:
+            target, entry = target_jobs[i]
+            results[i] = verify_copy(src_file, dest_files[n], sha256_src, xxh_src, target, entry)
+    return results
 
+FOLDER_STATE_FILENAME = "folder_state.json"
+# a folder synced at one accuracy can be skipped for the same or a lower one
+ACCURACY_RANK = {"size": 0, "sample": 1, "xxhash": 2, "sha256": 3}
+
+SYNC_PLAN_FILENAME = "sync_plan.json"
+SYNC_CHECKPOINT_FILENAME = "sync_checkpoint.json"
+# a checkpoint is saved after a batch of this many files or bytes is copied
+CHECKPOINT_BATCH_FILES = 100
+CHECKPOINT_BATCH_BYTES = 1024 * 1024 * 1024
+
+def get_folder_signature(folder_path, folder_files=None):
+    """Hash of the sorted (name, size, mtime) of a folder's files, or None if it is missing.
+    Any rename, added or removed file, or edit changes it, even on FAT / exFAT
+    where the dir mtime is not reliably updated.
+    folder_files is the folder's scan when the caller already has it, so it costs no extra io.
+    """
+    if folder_files is None:
+        if not os.path.isdir(folder_path):
+            return None
+        try:
+            folder_files = list(scan_folder(folder_path, ""))
+        except FileNotFoundError:
+            return None
+    records = sorted((os.path.relpath(f.path, folder_path).replace(os.sep, "/"), f.size, f.mtime_ns)
+                     for f in folder_files)
+    hasher = hashlib.sha256()
+    for name, size, mtime_ns in records:
+        hasher.update(f"{name}\0{size}\0{mtime_ns}\n".encode("utf-8"))
+    return hasher.hexdigest()
+
+def is_folder_unchanged(saved_state, src_signature, backup_folder, accuracy):
+    """True if both sides of a folder look as they did after its last successful sync"""
+    if not saved_state:
+        return False
+    if ACCURACY_RANK.get(saved_state.get("accuracy"), -1) < ACCURACY_RANK[accuracy]:
+        return False
+    if saved_state.get("source") != src_signature:
+        return False
+    return saved_state.get("backup") == get_folder_signature(backup_folder)
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Copy collection files to a backup volume")
+    parser.add_argument("primary_root", help="root of the primary collection volume")
+    parser.add_argument("--backup", action="append", default=None,
+                        help="root of a backup volume. repeat to copy to several backups in one pass (default: ask)")
+    parser.add_argument("--mode", choices=COMPARISON_MODES, default=None,
+                        help="comparison mode for files present in the backup (default: ask)")
+    parser.add_argument("--batch", action="store_true",
+                        help="never ask: needs --backup and --mode, for scheduled or scripted runs")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="files copied at the same time (default 4, 1 copies one at a time)")
+    parser.add_argument("--source-io", type=int, default=2,
+                        help="reads in progress at once on the primary volume (default 2)")
+    parser.add_argument("--dest-io", type=int, default=2,
+                        help="reads and writes in progress at once on each backup volume (default 2)")
+    parser.add_argument("--buffer-kb", type=int, default=None,
+                        help="read buffer per file for copying and hashing, in KB (default: probed, else 1024)")
+    parser.add_argument("--write-kb", type=int, default=None,
+                        help="write chunk size for copying, in KB (default: probed, else 1024)")
+    parser.add_argument("--probe", action="store_true",
+                        help="probe the read / write chunk sizes again, instead of using the saved probe")
+    parser.add_argument("--full", action="store_true",
+                        help="check every folder, including folders unchanged since the last sync")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="only build the sync plan, print its size and estimated time")
+    parser.add_argument("--restart", action="store_true",
+                        help="ignore an interrupted run's plan and start again")
+    parser.add_argument("--estimate-mbps", type=float, default=20.0,
+                        help="MB/s assumed for the dry run time estimate (default 20)")
+    parser.add_argument("--profile", action="store_true",
+                        help="profile the run with cProfile, saved in the tools folder")
+    args = parser.parse_args()
+    if args.batch and not (args.backup and args.mode):
+        parser.error("--batch needs --backup and --mode")
+    return args
+
+def run_jobs(job_func, jobs, num_workers):
+    """Run jobs on a thread pool, yielding results in job order.
+    At most 2 jobs per worker are queued, so memory and open files stay bounded.
+    """
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        in_flight = deque()
+        for job in jobs:
+            in_flight.append(executor.submit(job_func, *job))
+            if len(in_flight) >= num_workers * 2:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+def scan_primary(primary_root):
+    """Scan the primary once, for all backups.
+    Returns (folder name, folder files, folder signature) per collection folder, in scan order.
+    """
+    primary_folders = []
+    with tl_metrics.phase("scan"):
+        for folder_entry in list_collection_folders(primary_root):
+            folder_files = list(scan_folder(folder_entry.path, folder_entry.name))
+            src_signature = get_folder_signature(folder_entry.path, folder_files)
+            primary_folders.append((folder_entry.name, folder_files, src_signature))
+    print(f"Found {sum(len(files) for _, files, _ in primary_folders)} files in primary collection")
+    return primary_folders
+
+def build_sync_plan(primary_root, primary_folders, backup_root, accuracy, full, src_cache, dest_cache, num_workers, plan_id):
+    """Compare each primary file with one backup.
+    Folders unchanged since their last successful sync are left out unless full.
+    Each entry keeps its file's position in the primary scan as seq, so the
+    plans of several backups can be worked through together.
+    """
+    folder_state = load_tools_json(backup_root, FOLDER_STATE_FILENAME, {})
+    folder_signatures = {}
+    primary_files = []
+    skipped_folders = 0
+    skipped_files = 0
+    seq = 0
+    for folder_name, folder_files, src_signature in primary_folders:
+        first_seq = seq
+        seq += len(folder_files)
+        backup_folder = os.path.join(backup_root, folder_name)
+        if not full and is_folder_unchanged(folder_state.get(folder_name), src_signature, backup_folder, accuracy):
+            skipped_folders += 1
+            skipped_files += len(folder_files)
+            continue
+        folder_signatures[folder_name] = src_signature
+        primary_files.extend(zip(range(first_seq, seq), folder_files))
+    if skipped_folders:
+        print(f" Skipped {skipped_folders} folders unchanged since last sync ({skipped_files} files). Use --full to check them.")
+
+    print(f"Comparing with backup {backup_root}...")
+    jobs = ((src, backup_root, accuracy, src_cache, dest_cache) for _, src in primary_files)
+    entries = []
+    with tl_metrics.phase("compare"):
+        results = zip(primary_files, run_jobs(plan_file, jobs, num_workers))
+        for i, ((file_seq, _), entry) in enumerate(results, 1):
+            entry["seq"] = file_seq
+            entries.append(entry)
+            if i % 10 == 0:
+                print(f" → {i} / {len(primary_files)} compared{tl_metrics.rate_text(i)}", end="\r")
+    print(f" ✓ {len(entries)} / {len(primary_files)} compared")
+
+    return {
+        "primary_root": str(primary_root),
+        "accuracy": accuracy,
+        "plan_id": plan_id,
+        "folder_signatures": folder_signatures,
+        "entries": entries,
+    }
+
+def print_plan_summary(backup_root, plan, estimate_mbps):
+    actions = {"copy": [0, 0], "conflict": [0, 0], "same": [0, 0], "error": [0, 0]}
+    for entry in plan["entries"]:
+        actions[entry["action"]][0] += 1
+        actions[entry["action"]][1] += entry["size"]
+    copy_bytes = actions["copy"][1] + actions["conflict"][1]
+    # every copied byte is written once then read back once
+    est_seconds = 2 * copy_bytes / (estimate_mbps * 1000 * 1000)
+    print(f"\nSync plan for {backup_root}:")
+    print(f" {actions['copy'][0]} to copy, {actions['copy'][1] / 1e6:.1f} MB")
+    print(f" {actions['conflict'][0]} dest-rename then copy, {actions['conflict'][1] / 1e6:.1f} MB")
+    print(f" {actions['same'][0]} same, {actions['error'][0]} errors")
+    print(f" Total to copy: {copy_bytes / 1e6:.1f} MB, about {est_seconds / 60:.1f} min at {estimate_mbps:g} MB/s")
+
+def save_folder_states(backup_root, plan, failed_folders, accuracy):
+    """Remember the folders that synced without errors"""
+    folder_state = load_tools_json(backup_root, FOLDER_STATE_FILENAME, {})
+    for folder_name, src_signature in plan["folder_signatures"].items():
+        if folder_name in failed_folders:
+            folder_state.pop(folder_name, None)
+            continue
+        folder_state[folder_name] = {
+            "source": src_signature,
+            "backup": get_folder_signature(os.path.join(backup_root, folder_name)),
+            "accuracy": accuracy,
+        }
+    save_tools_json(backup_root, FOLDER_STATE_FILENAME, folder_state)
+
+class BackupTarget:
+    """One backup volume of a run, with its digest cache, plan, checkpoint and counts.
+    Each backup keeps its own plan and checkpoint on its own volume.
+    """
+
+    def __init__(self, root, cache):
+        self.root = root
+        self.cache = cache
+        self.plan = None
+
+    def load_plan(self, primary_root, accuracy):
+        """The plan of an interrupted run, if it was for this primary and accuracy"""
+        plan = load_tools_json(self.root, SYNC_PLAN_FILENAME)
+        if plan and plan.get("primary_root") == str(primary_root) and plan.get("accuracy") == accuracy:
+            return plan
+        return None
+
+    def start(self, plan, checkpoint):
+        self.plan = plan
+        entries = plan["entries"]
+        # the plan is in scan order: folder by folder, each in directory order.
+        # results are recorded in that order, so copies are synced per folder.
+        self.work_entries = [e for e in entries if e["action"] in ("copy", "conflict")]
+        for entry in self.work_entries:
+            dest_folder, filename = os.path.split(os.path.join(self.root, entry["relpath"]))
+            planned_dest_names.setdefault(dest_folder, []).append(filename)
+        self.done = checkpoint.get("done", 0)
+        self.total_files = len(entries)
+        self.errors_list = checkpoint.get("errors_list", [])
+        self.failed_folders = set(checkpoint.get("failed_folders", []))
+        self.copied = checkpoint.get("copied", 0)
+        self.renamed = checkpoint.get("renamed", 0)
+        self.same = 0
+        for entry in entries:
+            if entry["action"] == "same":
+                self.same += 1
+            elif entry["action"] == "error" and not checkpoint:
+                self.add_error(entry["relpath"].split(os.sep)[0], entry["message"])
+        self.checked = self.total_files - len(self.work_entries) + self.done
+        self.batch_files = 0
+        self.batch_bytes = 0
+        self.unsynced = []
+        self.sync_folder = None
+
+    def remaining_entries(self):
+        return self.work_entries[self.done:]
+
+    def add_error(self, folder_name, message):
+        self.errors_list.append(message)
+        self.failed_folders.add(folder_name)
+
+    def sync(self):
+        """Flush the copies written since the last sync to the card"""
+        with tl_metrics.phase("sync"):
+            failures = sync_files(self.unsynced)
+        for file_path, e in failures.items():
+            self.add_error(os.path.relpath(file_path, self.root).split(os.sep)[0],
+                           f"Error: Copy not synced to the card ({e}) - DestFile: {file_path}")
+        self.unsynced = []
+
+    def record(self, entry, success, status_message):
+        """Count the result of one work entry. Results must come in plan order"""
+        # the first result of a folder ends the last one, its copies are synced
+        folder = os.path.dirname(entry["relpath"])
+        if folder != self.sync_folder:
+            self.sync()
+            self.sync_folder = folder
+        if success:
+            self.unsynced.append(os.path.join(self.root, entry["relpath"]))
+            if status_message == "copied":
+                self.copied += 1
+            elif status_message == "renamed":
+                self.renamed += 1
+        else:
+            self.add_error(entry["relpath"].split(os.sep)[0], status_message)
+        self.done += 1
+        self.checked += 1
+        self.batch_files += 1
+        self.batch_bytes += entry["size"]
+        if self.batch_files >= CHECKPOINT_BATCH_FILES or self.batch_bytes >= CHECKPOINT_BATCH_BYTES:
+            # every entry up to done is finished and synced before it is saved
+            self.sync()
+            self.cache.commit()
+            self.save_checkpoint()
+            self.batch_files = 0
+            self.batch_bytes = 0
+
+    def save_checkpoint(self):
+        save_tools_json(self.root, SYNC_CHECKPOINT_FILENAME, {
+            "done": self.done,
+            "copied": self.copied,
+            "renamed": self.renamed,
+            "errors_list": self.errors_list,
+            "failed_folders": sorted(self.failed_folders),
+        })
+
+    def status_text(self, accuracy):
+        return (f"{self.checked} / {self.total_files}, {self.copied} copied, {self.renamed} dest-renamed,"
+                f" {self.same} same-{accuracy}, {len(self.errors_list)} errors")
+
+    def finish(self, accuracy):
+        self.sync()
+        self.cache.close()
+        save_folder_states(self.root, self.plan, self.failed_folders, accuracy)
+        remove_tools_file(self.root, SYNC_PLAN_FILENAME)
+        remove_tools_file(self.root, SYNC_CHECKPOINT_FILENAME)
 
 def main():
-    if len(sys.argv) != 2:
-        print("Error: Primary root path not provided")
-        sys.exit(1)
+    args = get_args()
+    tl_metrics.start_run("copy", args.profile)
     
-    primary_root = Path(sys.argv[1])
+    primary_root = get_volume_path(args.primary_root)
     
     if not primary_root.exists():
         print(f"Error: Primary root path does not exist: {primary_root}")
@@ -153,68 +530,148 @@ def main():
     
     print(f"Selected Primary root: {primary_root}")
     
-    # Get backup root from user
-    backup_root_str = get_backup_root()
-    if not backup_root_str:
-        print("No backup root selected. Exiting.")
-        sys.exit(1)
-    
-    backup_root = Path(backup_root_str)
-    print(f"Selected Backup root: {backup_root}")
-    
-    if not backup_root.exists():
-        print(f"Error: Backup root path does not exist: {backup_root}")
-        sys.exit(1)
+    # Get backup roots from the arguments, or one from the user
+    backup_root_strs = args.backup
+    if not backup_root_strs:
+        backup_root_str = get_backup_root()
+        if not backup_root_str:
+            print("No backup root selected. Exiting.")
+            sys.exit(1)
+        backup_root_strs = [backup_root_str]
+
+    backup_roots = []
+    # roots are compared resolved, D: and D:\ or a relative path are one volume
+    resolved_roots = [primary_root.resolve()]
+    for backup_root_str in backup_root_strs:
+        backup_root = get_volume_path(backup_root_str)
+        print(f"Selected Backup root: {backup_root}")
+        if not backup_root.exists():
+            print(f"Error: Backup root path does not exist: {backup_root}")
+            sys.exit(1)
+        if backup_root.resolve() in resolved_roots:
+            print(f"Error: Backup root given twice, or same as primary: {backup_root}")
+            sys.exit(1)
+        backup_roots.append(backup_root)
+        resolved_roots.append(backup_root.resolve())
 
     # get the accuracy.
-    accuracy = get_comparison_mode()
+    accuracy = args.mode or get_comparison_mode()
     print("  ")
     print(f"Selected accuracy: {accuracy}")
     print("  ")
 
-    
-    # Get valid primary files from both roots
-    print("Scanning source collection...")
-    primary_files_to_copy = get_collection_files_shallow(primary_root)
-    print(f"Found {len(primary_files_to_copy)} files in primary collection")
-
-    total_files = len(primary_files_to_copy)
-    errors_list = []
-    errors = 0
-    checked = 0
-    copied = 0
-    renamed = 0
-    same = 0
-
-    print(f" → 0 / {total_files}, 0 copied, 0 dest-renamed, 0 same-{accuracy}, 0 errors", end="\r")
-        
-    for i, src in enumerate(primary_files_to_copy, 1):
-        relative_path = os.path.relpath(src, primary_root)
-        success, status_message = copy_and_verify_file(src, backup_root, relative_path, accuracy)
+    # digests are kept on each volume, so unchanged files are not hashed again.
+    # each volume has its own io slots, shared by all copy workers.
+    num_workers = max(1, args.workers)
+    if args.buffer_kb:
+        set_read_buffer_size(args.buffer_kb * 1024)
+    src_cache = DigestCache(primary_root, threading.Semaphore(max(1, args.source_io)))
+    targets = [BackupTarget(backup_root, DigestCache(backup_root, threading.Semaphore(max(1, args.dest_io))))
+               for backup_root in backup_roots]
+    print(f"Copy workers: {num_workers}, primary io: {args.source_io}, backup io: {args.dest_io}")
 
-        if success:
-            if status_message == "copied":
-                copied += 1
-            elif status_message == "renamed":
-                renamed += 1
-            elif status_message == "same":
-                same += 1
-        else:
-            errors_list.append(status_message)
-            errors += 1
+    # an interrupted run left its plans and checkpoints on the backup volumes.
+    # resuming skips the scan and compare, and the batches already copied.
+    # the plans of one run share a plan_id, and are only resumed all together.
+    plans = []
+    if not args.restart and not args.dry_run:
+        plans = [target.load_plan(primary_root, accuracy) for target in targets]
+        plan_ids = set(plan.get("plan_id") if plan else None for plan in plans)
+        if len(plan_ids) != 1 or None in plan_ids:
+            plans = []
+    if plans:
+        for target, plan in zip(targets, plans):
+            checkpoint = load_tools_json(target.root, SYNC_CHECKPOINT_FILENAME, {})
+            print(f"Resuming interrupted sync to {target.root}, {checkpoint.get('done', 0)} files already copied. Use --restart to start again.")
+            target.start(plan, checkpoint)
+    else:
+        # the primary is scanned once, then compared with each backup
+        print("Scanning source collection...")
+        primary_folders = scan_primary(primary_root)
+        plan_id = datetime.now().isoformat()
+        for target in targets:
+            target.plan = build_sync_plan(primary_root, primary_folders, target.root, accuracy, args.full,
+                                          src_cache, target.cache, num_workers, plan_id)
+        if args.dry_run:
+            for target in targets:
+                print_plan_summary(target.root, target.plan, args.estimate_mbps)
+                target.cache.close()
+            src_cache.close()
+            tl_metrics.finish_run(primary_root, {"files": len(targets[0].plan["entries"]), "backups": len(targets)})
+            return
+        for target in targets:
+            save_tools_json(target.root, SYNC_PLAN_FILENAME, target.plan)
+            remove_tools_file(target.root, SYNC_CHECKPOINT_FILENAME)
+            target.start(target.plan, {})
+
+    # one job per source file still to copy to any backup, in scan order.
+    # each job carries the plan entry of every backup that needs the file,
+    # so the file is read once however many backups there are.
+    jobs_by_seq = {}
+    for target in targets:
+        for entry in target.remaining_entries():
+            jobs_by_seq.setdefault(entry["seq"], []).append((target, entry))
+    source_jobs = [jobs_by_seq[seq] for seq in sorted(jobs_by_seq)]
 
-        checked += 1
-        if i % 10 == 0:
-            print(f" → {checked} / {total_files}, {copied} copied, {renamed} dest-renamed, {same} same-{accuracy}, {errors} errors", end="\r")
+    # chunk sizes from a short timed probe of each card, saved on the card
+    if source_jobs and not args.buffer_kb:
+        largest = sorted(source_jobs, key=lambda target_jobs: target_jobs[0][1]["size"], reverse=True)[:8]
+        largest_paths = [os.path.join(primary_root, target_jobs[0][1]["relpath"]) for target_jobs in largest]
+        read_chunk = get_chunk_size(primary_root, "read", lambda: probe_read(largest_paths), args.probe)
+        if read_chunk:
+            set_read_buffer_size(read_chunk)
+    if source_jobs and not args.write_kb:
+        # all backups are written with the same chunks, the largest any of them wants
+        write_chunks = [get_chunk_size(target.root, "write", lambda root=target.root: probe_write(root), args.probe)
+                        for target in targets if target.remaining_entries()]
+        write_chunks = [chunk for chunk in write_chunks if chunk]
+        if write_chunks:
+            set_write_chunk_size(max(write_chunks))
+    if args.write_kb:
+        set_write_chunk_size(args.write_kb * 1024)
+
+    def progress_text():
+        if len(targets) == 1:
+            return targets[0].status_text(accuracy)
+        return " | ".join(f"{target.checked} / {target.total_files}, {len(target.errors_list)} errors" for target in targets)
+
+    jobs = ((os.path.join(primary_root, target_jobs[0][1]["relpath"]), src_cache, target_jobs)
+            for target_jobs in source_jobs)
+
+    print(f" → {progress_text()}", end="\r")
+        
+    results = zip(source_jobs, run_jobs(copy_and_verify_file, jobs, num_workers))
+    with tl_metrics.phase("copy"):
+        for i, (target_jobs, job_results) in enumerate(results, 1):
+            for (target, entry), (success, status_message) in zip(target_jobs, job_results):
+                target.record(entry, success, status_message)
+            if i % 10 == 0:
+                print(f" → {progress_text()}{tl_metrics.rate_text(i)}", end="\r")
 
-    print(f" ✓ {checked} / {total_files}, {copied} copied, {renamed} dest-renamed, {same} same-{accuracy}, {errors} errors", end="\r")
-    print("")
+    for target in targets:
+        label = f"{target.root}: " if len(targets) > 1 else ""
+        print(f" ✓ {label}{target.status_text(accuracy)}", end="\r")
+        print("")
+    src_cache.close()
+    for target in targets:
+        target.finish(accuracy)
 
-    if errors_list:
-        print("\n  Errors:")
-        for error in errors_list:
-            print(error)
+    for target in targets:
+        if target.errors_list:
+            print(f"\n  Errors ({target.root}):" if len(targets) > 1 else "\n  Errors:")
+            for error in target.errors_list:
+                print(error)
 
+    # totals over all backups. with several backups the metrics are saved on the primary
+    tl_metrics.finish_run(targets[0].root if len(targets) == 1 else primary_root, {
+        "files": targets[0].total_files,
+        "backups": len(targets),
+        "source_files": len(source_jobs),
+        "copied": sum(target.copied for target in targets),
+        "dest_renamed": sum(target.renamed for target in targets),
+        "same": sum(target.same for target in targets),
+        "errors": sum(len(target.errors_list) for target in targets),
+    })
 
 if __name__ == "__main__":
     print(f"COPY COLLECTION FILES TO BACKUP\n VERIFY COPIED FILES WITH SH256 HASHES")
@@ -1,16 +1,24 @@
 # 2025-08-17 added ability to handle regex F-R
 # 2025-08-17 added ability to handle multiple F-R from json file
+# 2026-10-18 each folder's rules compiled into a FolderRuleSet with a match prefilter
+# 2026-10-18 settled filenames remembered per folder rule set, skipped on reruns
+# 2026-10-18 --batch and --undo for runs without dialogs or prompts
 
 import os
 import sys
 import re
+import hashlib
+import argparse
 from pathlib import Path
 import json
-import tkinter as tk
-from tkinter import filedialog
+from tl_common import load_tools_json, save_tools_json, ask_volume_root, get_volume_path
+from tl_scan import list_folder_entries, FolderNamespace
+import tl_metrics
 
 filename_data = "TimelineFR_BySets_current_data.json"
 folder_ignore_name = "HELP"
+# per folder: hash of its rules, and the filenames those rules left unchanged
+settled_filename = "fr_settled.json"
 
 # Blacklisted file types
 BLACKLISTED_EXTENSIONS = {".exe", ".dll", ".sys", ".bat"}
@@ -40,6 +48,87 @@ def compile_rule(rule):
             "exception": ""
         }
     
+def is_literal_rule(rule):
+    # case insensitive rules are compiled as regex, even if "regex" is false
+    return rule["case_sens"] and not rule["regex"]
+
+def build_trie_pattern(literals):
+    """One regex matching any of the literals, with shared prefixes merged.
+    re tries a plain alternation branch by branch at every position, which
+    gets slow with many rules. The trie form checks one character per level.
+    """
+    trie = {}
+    for literal in literals:
+        node = trie
+        for ch in literal:
+            node = node.setdefault(ch, {})
+        node[""] = {}  # end of a literal
+
+    def build(node):
+        if "" in node and len(node) == 1:
+            return ""
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if len(branches) == 1 and "" not in node:
+            return branches[0]
+        pattern = "(?:" + "|".join(branches) + ")"
+        return pattern + "?" if "" in node else pattern
+
+    return build(trie)
+
+class FolderRuleSet:
+    """One folder's compiled rules.
+
+    apply() gives the same result as running each rule in order on the filename.
+    A filename that no rule matches can not be changed by any rule, so a
+    prefilter checks that first: one search for all literal rules combined,
+    then a search per regex rule. Most filenames stop there.
+    """
+
+    def __init__(self, rules):
+        self.rules = rules
+        rules_key = [[r["case_sens"], r["regex"], getattr(r["find"], "pattern", r["find"]), r["replace"]]
+                     for r in rules]
+        self.rules_hash = hashlib.sha256(json.dumps(rules_key).encode("utf-8")).hexdigest()
+        literals = set(r["find"] for r in rules if is_literal_rule(r))
+        self.literal_prefilter = None
+        if literals:
+            self.literal_prefilter = re.compile(build_trie_pattern(literals))
+        self.regex_finds = [r["find"] for r in rules if not is_literal_rule(r)]
+        # a bad replace template errors on every filename, matched or not.
+        # keep reporting that for each file, as running the rules in order does.
+        self.always_apply = False
+        for rule in rules:
+            if not is_literal_rule(rule):
+                try:
+                    rule["find"].sub(rule["replace"], "")
+                except Exception:
+                    self.always_apply = True
+
+    def could_change(self, filename):
+        if self.always_apply:
+            return True
+        if self.literal_prefilter is not None and self.literal_prefilter.search(filename):
+            return True
+        return any(find.search(filename) for find in self.regex_finds)
+
+    def apply(self, filename, folder_name, errorlist):
+        if not self.could_change(filename):
+            return filename
+        filename_new = filename
+        for rule in self.rules:
+
+            try:
+                if is_literal_rule(rule):
+                    if rule["find"] in filename_new:
+                        filename_new = filename_new.replace(rule["find"], rule["replace"])
+                else:
+                    filename_new = rule["find"].sub(rule["replace"], filename_new)
+
+            except Exception as e:
+                errorlist.append(f"Rule error in {folder_name}: {e}")
+                continue
+        return filename_new
+
 def precompile_data_dict(raw_data):
     compiled_data = {}
     compile_errorlist = []
@@ -56,74 +145,100 @@ def precompile_data_dict(raw_data):
                 compile_errorlist.append(f"Rule compile error: {rule}")
             else:
                 folder_rules.append(rule_compiled)
-        compiled_data[folder_name] = folder_rules
+        compiled_data[folder_name] = FolderRuleSet(folder_rules)
     return compiled_data, compile_errorlist
 
 def rename_files(root_str, precomp_fr_data):
     errorlist = []
+    # filenames a folder's identical rule set already left unchanged
+    # are skipped without evaluating any rule.
+    settled_data = load_tools_json(root_str, settled_filename, {})
+    # files checked in all folders, for the rate on the progress line
+    run_checked = 0
 
-    for folder_name, replacement_objs in precomp_fr_data.items():
+    for folder_name, rule_set in precomp_fr_data.items():
         if folder_name == folder_ignore_name:
             continue
-        if len(replacement_objs) == 0:
+        if len(rule_set.rules) == 0:
             continue
         folder_path = os.path.join(root_str, folder_name)
+        tl_metrics.count("fs_stat")
         if not os.path.exists(folder_path):
             continue
         print(f"Processing: {folder_path}")
-        filenames = os.listdir(folder_path)
+        # one directory read. collisions are then resolved in memory,
+        # only the renames themselves touch the card.
+        with tl_metrics.phase("scan"):
+            entries = list_folder_entries(folder_path)
+        filenames = [entry.name for entry in entries if entry.is_file()]
+        namespace = FolderNamespace(folder_path, [entry.name for entry in entries])
         num_files = len(filenames)
 
+        folder_settled = settled_data.get(folder_name, {})
+        if folder_settled.get("rules_hash") == rule_set.rules_hash:
+            settled = set(folder_settled.get("filenames", []))
+        else:
+            settled = set()
+        settled_now = []
+
         renamed = 0
         unmodified = 0
         checked = 0
         error = 0
+        skipped = 0
 
         for filename_ori in filenames:
             checked += 1
+            run_checked += 1
             src_path = os.path.join(folder_path, filename_ori)
 
-            # Skip folders and blacklisted extensions
-            if not os.path.isfile(src_path) or any(filename_ori.lower().endswith(ext) for ext in BLACKLISTED_EXTENSIONS):
+            # Skip blacklisted extensions
+            if any(filename_ori.lower().endswith(ext) for ext in BLACKLISTED_EXTENSIONS):
                 continue
 
-            filename_new = filename_ori
-            for rule in replacement_objs:
-
-                try:
-                    if rule["case_sens"] and not rule["regex"]:
-                        if rule["find"] in filename_new:
-                            filename_new = filename_new.replace(rule["find"], rule["replace"])
-                    else:
-                        filename_new = rule["find"].sub(rule["replace"], filename_new)
+            if filename_ori in settled:
+                unmodified += 1
+                skipped += 1
+                settled_now.append(filename_ori)
+                continue
 
-                except Exception as e:
-                    errorlist.append(f"Rule error in {folder_name}: {e}")
-                    continue
+            num_errors = len(errorlist)
+            filename_new = rule_set.apply(filename_ori, folder_name, errorlist)
 
             if filename_new == filename_ori:
                 unmodified += 1
+                if len(errorlist) == num_errors:
+                    settled_now.append(filename_ori)
             else:
-                dst_path = os.path.join(folder_path, filename_new)
-                suffix = 1
-                while os.path.exists(dst_path):
-                    base, ext = os.path.splitext(filename_new)
-                    dst_path = os.path.join(folder_path, f"{base}_{suffix}{ext}")
-                    suffix += 1
+                # the file's own name is free to it, so a rename that only
+                # changes case does not collide with itself
+                namespace.remove(filename_ori)
+                filename_dst = namespace.unique_name(filename_new)
+                dst_path = os.path.join(folder_path, filename_dst)
 
                 try:
+                    tl_metrics.count("fs_rename")
                     os.rename(src_path, dst_path)
+                    namespace.add(filename_dst)
                     undo_queue.append((dst_path, src_path))
                     renamed += 1
                 except OSError as e:
+                    namespace.add(filename_ori)
                     errorlist.append(f"Error renaming {filename_ori}: {e}")
                     error += 1
 
             if checked % 10 == 0:
-                print(f" → {checked} / {num_files}, {renamed} renamed, {unmodified} unmodified, {error} errors", end="\r")
+                print(f" → {checked} / {num_files}, {renamed} renamed, {unmodified} unmodified, {error} errors{tl_metrics.rate_text(run_checked)}", end="\r")
 
-        print(f" ✓ {checked} / {num_files}, {renamed} renamed, {unmodified} unmodified, {error} errors", end="\r")
+        print(f" ✓ {checked} / {num_files}, {renamed} renamed, {unmodified} unmodified ({skipped} settled), {error} errors", end="\r")
         print("")
+        settled_data[folder_name] = {"rules_hash": rule_set.rules_hash, "filenames": settled_now}
+        tl_metrics.count("files", num_files)
+        tl_metrics.count("renamed", renamed)
+        tl_metrics.count("settled", skipped)
+        tl_metrics.count("errors", error)
+
+    save_tools_json(root_str, settled_filename, settled_data)
 
     if errorlist:
         print("\nERRORS:")
@@ -141,25 +256,34 @@ def undo_rename():
             print(f"Undo error: {e} ({new_path})")
 
 def get_volume_root():
-    root = tk.Tk()
-    root.withdraw()  # Hide the main window
-    backup_root = filedialog.askdirectory(
-        title="Select Drive letter of Collection"
-    )
-    root.destroy()
-    if backup_root and os.path.ismount(backup_root):
-        return backup_root
-    return None
+    return ask_volume_root("Select Drive letter of Collection")
 
 if __name__ == "__main__":
     print(f"TIMELINE TOOL - rename filenames with find-replace")
     print(f"- using a prepared list of F-R strings")
     print(f"  placed at the top of the script")
+    parser = argparse.ArgumentParser(description="Rename files with each folder's find-replace rules")
+    parser.add_argument("root", nargs="?", help="collection root, asked for if not given")
+    parser.add_argument("--undo", choices=["ask", "keep", "undo"], default="ask",
+                        help="after renaming: ask, keep the renames, or undo them all (default ask)")
+    parser.add_argument("--batch", action="store_true",
+                        help="never ask: needs root, keeps the renames unless --undo undo. for scheduled or scripted runs")
+    parser.add_argument("--profile", action="store_true",
+                        help="profile the run with cProfile, saved in the tools folder")
+    args = parser.parse_args()
+    if args.batch and not args.root:
+        parser.error("--batch needs root")
+    if args.batch and args.undo == "ask":
+        args.undo = "keep"
+    tl_metrics.start_run("filename_fr", args.profile)
     # can get vol root via .cmd script. easier.
-    if len(sys.argv) == 2:
-        root_str = Path(sys.argv[1])
+    if args.root:
+        root_str = get_volume_path(args.root)
     else:
         root_str = get_volume_root()
+        if not root_str:
+            print("No collection root selected. Exiting.")
+            sys.exit(1)
 
     dir_script_parent = str(Path(__file__).resolve().parent)
     filepath_data = os.path.join(dir_script_parent, filename_data)
@@ -169,8 +293,9 @@ if __name__ == "__main__":
 
     except json.JSONDecodeError as e:
         print(f"JSON load error: {e}")
-        input("\nfix json file error then enter to quit.")
-        sys.exit()
+        if not args.batch:
+            input("\nfix json file error then enter to quit.")
+        sys.exit(1)
 
 
     # if adding regex to json, can precompile them before sending to next step. 
@@ -179,12 +304,18 @@ if __name__ == "__main__":
         print(f"ERRORS in raw data file.")
         for err in compile_errorlist:
             print(err)
-        input("\nfix data errors then enter to quit.")
-        sys.exit()
+        if not args.batch:
+            input("\nfix data errors then enter to quit.")
+        sys.exit(1)
 
-    rename_files(root_str, precomp_fr_data)
+    with tl_metrics.phase("rename"):
+        rename_files(root_str, precomp_fr_data)
+    tl_metrics.finish_run(root_str)
 
     if undo_queue:
-        choice = input("\nUndo changes? (enter any char or nothing to keep changes): ").strip().lower()
-        if choice != "":
+        if args.undo == "ask":
+            choice = input("\nUndo changes? (enter any char or nothing to keep changes): ").strip().lower()
+            if choice != "":
+                undo_rename()
+        elif args.undo == "undo":
             undo_rename()
\ No newline at end of file
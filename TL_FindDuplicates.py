@@ -0,0 +1,137 @@
+# TIMELINE TOOL - find duplicate files in the collection
+# - files are grouped by size, then by a hash of their first and last block,
+#   and only files still grouped are hashed in full
+# - writes a report of the duplicate sets, nothing is deleted or renamed
+
+# 20261018 created
+
+#!/usr/bin/env python3
+import os
+import sys
+import argparse
+from tl_scan import scan_collection
+from tl_common import get_volume_path
+from tl_hashing import compute_partial_hash, DigestCache
+import tl_metrics
+
+REPORT_FILENAME = "_ScriptGeneratedDuplicatesReport.txt"
+
+def group_by(files, key_func):
+    """Groups of files with the same key, leaving out keys with one file"""
+    groups = {}
+    for f in files:
+        groups.setdefault(key_func(f), []).append(f)
+    return [group for group in groups.values() if len(group) > 1]
+
+def find_duplicate_sets(collection_files, cache, block_size, errors_list):
+    """Lists of files with identical content.
+    Each tier only looks at the files the previous tier left grouped.
+    """
+    # tier 1: size, from the scan. no reads.
+    with tl_metrics.phase("size"):
+        size_groups = group_by(collection_files, lambda f: f.size)
+    candidates = [f for group in size_groups for f in group]
+    print(f" Same size as another file: {len(candidates)} files in {len(size_groups)} groups")
+
+    # tier 2: head and tail blocks, one or two small reads per file
+    def partial_key(f):
+        try:
+            return f.size, compute_partial_hash(f.path, block_size)
+        except OSError as e:
+            errors_list.append(f"Error: not read: {f.path} ({e})")
+            return None
+
+    partial_groups = []
+    with tl_metrics.phase("partial hash"):
+        for i, group in enumerate(size_groups, 1):
+            keyed = [(partial_key(f), f) for f in group]
+            partial_groups.extend(group_by([(k, f) for k, f in keyed if k is not None], lambda kf: kf[0]))
+            if i % 10 == 0:
+                print(f" → {i} / {len(size_groups)} size groups{tl_metrics.rate_text(i)}", end="\r")
+    partial_groups = [[f for _, f in group] for group in partial_groups]
+    num_partial = sum(len(group) for group in partial_groups)
+    print(f" Same head and tail as another file: {num_partial} files in {len(partial_groups)} groups")
+
+    # tier 3: full sha256, from the digest cache where still valid
+    def full_key(f):
+        try:
+            return cache.sha256(f.path)
+        except OSError as e:
+            errors_list.append(f"Error: not read: {f.path} ({e})")
+            return None
+
+    duplicate_sets = []
+    with tl_metrics.phase("full hash"):
+        for i, group in enumerate(partial_groups, 1):
+            keyed = [(full_key(f), f) for f in group]
+            for dup_group in group_by([(k, f) for k, f in keyed if k is not None], lambda kf: kf[0]):
+                duplicate_sets.append((dup_group[0][0], [f for _, f in dup_group]))
+            if i % 10 == 0:
+                print(f" → {i} / {len(partial_groups)} hashed groups{tl_metrics.rate_text(i)}", end="\r")
+    return duplicate_sets
+
+def write_report(report_path, duplicate_sets):
+    """Duplicate sets with the most wasted space first"""
+    duplicate_sets = sorted(duplicate_sets, key=lambda d: d[1][0].size * (len(d[1]) - 1), reverse=True)
+    with open(report_path, "w", encoding="utf-8") as f:
+        for sha256, files in duplicate_sets:
+            f.write(f"{len(files)} x {files[0].size} bytes  sha256 {sha256}\n")
+            for collection_file in sorted(files, key=lambda c: c.relpath):
+                f.write(f"  {collection_file.relpath}\n")
+            f.write("\n")
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Find duplicate files in the collection")
+    parser.add_argument("primary_root", help="root of the collection volume")
+    parser.add_argument("--block-kb", type=int, default=64,
+                        help="head and tail block size for the partial hash, in KB (default 64)")
+    parser.add_argument("--profile", action="store_true",
+                        help="profile the run with cProfile, saved in the tools folder")
+    return parser.parse_args()
+
+def main():
+    args = get_args()
+    tl_metrics.start_run("find_duplicates", args.profile)
+
+    primary_root = get_volume_path(args.primary_root)
+    if not primary_root.exists():
+        print(f"Error: Primary root path does not exist: {primary_root}")
+        sys.exit(1)
+    print(f"Primary SD card root: {primary_root}")
+
+    print("Scanning primary collection...")
+    with tl_metrics.phase("scan"):
+        primary_files = list(scan_collection(primary_root))
+    print(f" Primary collection: {len(primary_files)} files.")
+
+    errors_list = []
+    cache = DigestCache(primary_root)
+    duplicate_sets = find_duplicate_sets(primary_files, cache, args.block_kb * 1024, errors_list)
+    cache.close()
+
+    num_dup_files = sum(len(files) for _, files in duplicate_sets)
+    wasted = sum(files[0].size * (len(files) - 1) for _, files in duplicate_sets)
+    print(f" ✓ {len(duplicate_sets)} duplicate sets, {num_dup_files} files, {wasted / 1e6:.1f} MB in extra copies")
+
+    report_path = os.path.join(primary_root, REPORT_FILENAME)
+    if duplicate_sets:
+        try:
+            write_report(report_path, duplicate_sets)
+            print(f"Report saved: {report_path}")
+        except OSError as e:
+            errors_list.append(f"Error: report not saved: {e}")
+    else:
+        print("No duplicates found. No report saved.")
+
+    if errors_list:
+        print(f"\n  ERRORS: {len(errors_list)}")
+        for err_str in errors_list:
+            print(err_str)
+
+    tl_metrics.finish_run(primary_root, {"files": len(primary_files), "duplicate_sets": len(duplicate_sets),
+                                         "duplicate_files": num_dup_files, "errors": len(errors_list)})
+
+if __name__ == "__main__":
+    print("COLLECTION TOOL: Find duplicate files")
+    print("- report only, no files are changed")
+    main()
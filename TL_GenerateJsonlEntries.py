@@ -1,58 +1,34 @@
 # create a JSONL file with a JOURNAL entry for each file in the TIMELINE set
 
+# 20261018 datetime / location index of the journal built after it is saved, for TL_QueryJournal
+# 20261018 mimetypes imported on first use, tkinter import removed (never used)
+# 20261018 sidecar records the versions of the code that made its entries
+# 20261018 last run's entries read from the sidecar by offset, not held in memory
+# 20261018 incremental by default: unchanged files reuse their entry from the sidecar index
+# 20261018 device_type / device_code from the EXIF or mp4 header (camera make / model)
+# 20261018 datetime prefix from the shared tl_dtparse parser
 # 20250815 untrested draft
 # 20250814 created from copy of cleanup script
 
 #!/usr/bin/env python3
 import os
 import sys
-import re
 import json
-import mimetypes
-from pathlib import Path
-import tkinter as tk
-from tkinter import filedialog
-
-def get_dt_patterns():
-    re1 = re.compile(r"^(?<date>\d{4}-\d{2}-\d{2})[ _](?<time_fn>\d{2}([-_]\d{2})?([-_]\d{2})?(\.\d{3,6})?)(?<utc_offset>[\+-]\d{4})? "),
-    re2 = re.compile(r"^(?<date>\d{4}-\d{2}-\d{2}) "),
-    re3 = re.compile(r"^(?<date>\d{4}(-\d{2})?) "),
-    return [re1, re2, re3]
-
-def get_collection_files(root_path):
-    """Get all files in collection directories (excluding root files and _* root dirs)"""
-    root_path = Path(root_path)
-    files_to_copy = []
-    for item in root_path.iterdir():
-        if item.is_file():
-            continue
-        elif item.is_dir() and item.name.startswith('_'):
-            continue
-        elif item.is_dir() and item.name.startswith('System Volume'):
-            continue
-        else:
-            for root_dir, _, files in os.walk(item):
-                for file in files:
-                    files_to_copy.append(os.path.join(root_dir, file))
-    return files_to_copy
+import argparse
+from tl_scan import scan_collection
+from tl_common import get_tools_dir, get_volume_path
+from tl_journal import JOURNAL_FILENAME, SortedLinesWriter, build_journal_index
+from tl_devicemeta import DeviceMetaCache, DEVICE_META_VERSION
+from tl_dtparse import parse_timeline_datetime, PARSER_VERSION
+import tl_metrics
 
-def extract_datetime_values(file_path, patterns):
-    # patterns are precompiled in main() before any loop
+def extract_datetime_values(file_path):
     parentpath, filename = os.path.split(file_path)
     filename_base, ext = os.path.splitext(filename)
-    match_substr = ""
-    pattern_used = None
-    for pattern in patterns:
-        match = pattern.match(filename)
-        if match:
-            match_str = match.group()
-            match_len = len(match_str)
-            remainder = filename_base[match_len:]
-            named_parts = match.groupdict()   
-            date = named_parts.get('date')
-            time = named_parts.get('time')
-            utc_offset = named_parts.get('utc_offset')
-            return date, time, utc_offset, remainder, ext
+    prefix = parse_timeline_datetime(filename)
+    if prefix is not None:
+        remainder = filename_base[prefix.length:]
+        return prefix.date, prefix.time, prefix.utc_offset, remainder, ext
 
     return "", "", "", "", ext
 
@@ -66,26 +42,109 @@ def extract_location(remainder):
     return "", remainder
     
 def detect_mimetype(filepath):
+    # imported here, it is only needed once there are entries to make
+    import mimetypes
     mime_type, _ = mimetypes.guess_type(filepath)
     if not mime_type: return ""
     return mime_type
     
-def trysave_string_to_utf8_file_ret_bool(file_output, file_string):
-    try:
-        with open(file_output, 'w', encoding='utf-8') as f:
-            f.write(file_string)
-        return True
-    except Exception as e:
-        print('ERROR: save file exception: ', e)
-        return False
+def make_entry(pri_file_path, device_meta=("", "")):
+    """Journal entry json string for one file, or None if its name has no date.
+    device_meta is the (make, model) read from the file header.
+    """
+    date, time, utc_offset, remainder, ext = extract_datetime_values(pri_file_path)
+    if date == "":
+        return None
+    location, description = extract_location(remainder)
+    mime_type = detect_mimetype(pri_file_path)
+
+    device_type, device_code = device_meta
+
+    dict_entry = {
+        "date": date,
+        "time": time,
+        "utc_offset": utc_offset,
+        "location": location,
+        "description": description,
+        "format": mime_type,
+        "device_type": device_type,
+        "device_code": device_code,
+        "tags": ["timeline", "file"]
+    }
+    return json.dumps(dict_entry)
+
+# one line per collection file: relpath, size, mtime_ns and its journal entry
+# (null when no date was found). unchanged files reuse their entry.
+SOURCES_INDEX_FILENAME = "journal_sources.jsonl"
+# raise this when make_entry makes a different entry than before
+ENTRY_FORMAT_VERSION = 1
+# first line of the sidecar. entries made by other code are not reused.
+SOURCES_INDEX_HEADER = {"entry_format": ENTRY_FORMAT_VERSION, "dtparse": PARSER_VERSION,
+                        "device_meta": DEVICE_META_VERSION}
+
+class SourcesIndex:
+    """The sidecar of the last run. Only size, mtime_ns and the line offset
+    are kept per file, an entry is read from the file when it is reused.
+    The new sidecar is written beside it, so it stays readable until the end.
+    A sidecar whose header is not SOURCES_INDEX_HEADER is outdated, none of
+    its entries are used.
+    """
+
+    def __init__(self, volume_root=None):
+        self.sources = {}
+        self.file = None
+        self.outdated = False
+        if volume_root is None:
+            return
+        index_path = os.path.join(get_tools_dir(volume_root), SOURCES_INDEX_FILENAME)
+        try:
+            self.file = open(index_path, "rb")
+            header = self.file.readline()
+            if json.loads(header) != SOURCES_INDEX_HEADER:
+                self.outdated = True
+                self.close()
+                return
+            offset = len(header)
+            for line in self.file:
+                item = json.loads(line)
+                self.sources[item["relpath"]] = (item["size"], item["mtime_ns"], offset)
+                offset += len(line)
+        except (OSError, ValueError, KeyError):
+            self.close()
+            self.sources = {}
+
+    def __len__(self):
+        return len(self.sources)
+
+    def is_unchanged(self, relpath, size, mtime_ns):
+        previous = self.sources.get(relpath)
+        return previous is not None and previous[0] == size and previous[1] == mtime_ns
+
+    def entry(self, relpath):
+        self.file.seek(self.sources[relpath][2])
+        return json.loads(self.file.readline())["entry"]
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Generate journal entries from timeline files")
+    parser.add_argument("primary_root", help="root of the collection volume")
+    parser.add_argument("--full", action="store_true",
+                        help="extract every file again, ignoring the entries of the last run")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="processes reading device metadata (default: one per cpu)")
+    parser.add_argument("--profile", action="store_true",
+                        help="profile the run with cProfile, saved in the tools folder")
+    return parser.parse_args()
 
 def main():
-    if len(sys.argv) != 2:
-        print("Error: Primary root path not provided")
-        sys.exit(1)
+    args = get_args()
+    tl_metrics.start_run("journal", args.profile)
     
-    primary_root_str = sys.argv[1] + "\\"
-    primary_root = Path(primary_root_str)
+    primary_root = get_volume_path(args.primary_root)
     
     if not primary_root.exists():
         print(f"Error: Primary root path does not exist: {primary_root}")
@@ -95,7 +154,8 @@ def main():
     
     # Get collection files from both roots
     print("Scanning primary collection...")
-    primary_files = get_collection_files(primary_root)
+    with tl_metrics.phase("scan"):
+        primary_files = list(scan_collection(primary_root))
     num_primary_files = len(primary_files)
     print(f" Primary collection: {num_primary_files} files.")
 
@@ -105,59 +165,93 @@ def main():
     checked = 0
     extracted = 0
     errors = 0
+    reused = 0
     errors_list = []
-    entries_list = []
-    datetime_patterns = get_dt_patterns()
-
-    print(f" → 0 / {num_primary_files}, 0 extracted, 0 errors", end="\r")
-
-    for pri_file_path in primary_files:
-
-        checked += 1
-        date, time, utc_offset, remainder, ext = extract_datetime_values(pri_file_path, datetime_patterns)
-        if date == "":
-            errors += 1
-            continue
-        location, description = extract_location(remainder)
-        mime_type = detect_mimetype(pri_file_path)
-
-        # can use IM to extract camera data
-        device_type = ""
-        device_code = ""
-
-        dict_entry = {
-            "date": date,
-            "time": time,
-            "utc_offset": utc_offset,
-            "location": location,
-            "description": description,
-            "format": mime_type,
-            "device_type": device_type,
-            "device_code": device_code,
-            "tags": ["timeline", "file"]
-        }
-
-        entry_str = json.dumps(dict_entry)
-        entries_list.append(entry_str)
-        extracted += 1
-
-        if checked % 10 == 0:
-            print(f" → {checked} / {num_primary_files}, {extracted} extracted, {errors} errors", end="\r")
-
-    print(f" ✓ {checked} / {num_primary_files}, {extracted} extracted, {errors} errors", end="\r")
-    print("")
+    # entries go to sorted runs on disk as they are made, so memory stays flat
+    file_output = os.path.join(primary_root, JOURNAL_FILENAME)
+    entries_writer = SortedLinesWriter(file_output, primary_root)
 
-    if entries_list:
-        # save to root level file.
-        entries_sorted = sorted(entries_list)
-        file_string = '\n'.join(entries_sorted)
+    # files with the same size and mtime as last run keep their entry.
+    # files no longer in the collection are dropped by not being scanned.
+    sources = SourcesIndex()
+    if not args.full and os.path.exists(file_output):
+        sources = SourcesIndex(primary_root)
+        if sources.outdated:
+            print(" Entries from last run were made by older code, every file is extracted again.")
+        else:
+            print(f" Entries from last run: {len(sources)}")
+    index_path = os.path.join(get_tools_dir(primary_root), SOURCES_INDEX_FILENAME)
+
+    def is_reused(pri_file):
+        return sources.is_unchanged(pri_file.relpath, pri_file.size, pri_file.mtime_ns)
+
+    # camera make / model for the files to extract, read up front across
+    # processes. only header bytes are read, and results are cached per file.
+    device_cache = DeviceMetaCache(primary_root)
+    print(" Reading device metadata...", end="\r")
+    with tl_metrics.phase("device_meta"):
+        num_read = device_cache.fill([f for f in primary_files if not is_reused(f)], args.workers)
+    print(f" Device metadata: {num_read} files read.")
+
+    index_file = open(index_path + ".tmp", "w", encoding="utf-8", newline="\n")
+    index_file.write(json.dumps(SOURCES_INDEX_HEADER) + "\n")
+
+    print(f" → 0 / {num_primary_files}, 0 extracted, 0 reused, 0 errors", end="\r")
+
+    with tl_metrics.phase("entries"):
+        for pri_file in primary_files:
 
-        filename = f"_ScriptGeneratedJournalEntries.jsonl" # 
-        file_output = os.path.join(primary_root, filename)
-        saved = trysave_string_to_utf8_file_ret_bool(file_output, file_string)
-        if saved == False:
-            errors_list.append(f'Filesave error: {filename}')
+            checked += 1
+            pri_file_path = pri_file.path
+            if is_reused(pri_file):
+                entry_str = sources.entry(pri_file.relpath)
+                reused += 1
+            else:
+                entry_str = make_entry(pri_file_path, device_cache.get(pri_file))
+                if entry_str is not None:
+                    extracted += 1
+            index_file.write(json.dumps({"relpath": pri_file.relpath, "size": pri_file.size,
+                                         "mtime_ns": pri_file.mtime_ns, "entry": entry_str}) + "\n")
+            if entry_str is None:
+                errors += 1
+                continue
+            try:
+                entries_writer.add(entry_str)
+            except OSError as e:
+                print(f"\nERROR: journal temp file write failed: {e}")
+                entries_writer.discard()
+                sys.exit(1)
+
+            if checked % 10 == 0:
+                print(f" → {checked} / {num_primary_files}, {extracted} extracted, {reused} reused, {errors} errors{tl_metrics.rate_text(checked)}", end="\r")
+
+    print(f" ✓ {checked} / {num_primary_files}, {extracted} extracted, {reused} reused, {errors} errors", end="\r")
+    print("")
+    index_file.close()
+    sources.close()
+    device_cache.save(primary_files)
+
+    if entries_writer.count:
+        # save to root level file. merged from the sorted runs, then
+        # renamed over the old journal.
+        try:
+            with tl_metrics.phase("merge"):
+                entries_writer.finish()
+            os.replace(index_path + ".tmp", index_path)
+        except OSError as e:
+            print('ERROR: save file exception: ', e)
+            errors_list.append(f'Filesave error: {JOURNAL_FILENAME}')
+        else:
+            # sorted datetime and location index, so queries seek to their lines
+            try:
+                with tl_metrics.phase("index"):
+                    num_indexed = build_journal_index(primary_root, file_output)
+                print(f" Journal index: {num_indexed} entries.")
+            except OSError as e:
+                errors_list.append(f'Journal index not saved: {e}')
     else:
+        entries_writer.discard()
+        os.remove(index_path + ".tmp")
         print(f"NO ENTRIES EXTRACTED. No file saved.")
 
     if errors_list:
@@ -165,6 +259,9 @@ def main():
         for err_str in errors_list:
             print(err_str)
 
+    tl_metrics.finish_run(primary_root, {"files": num_primary_files, "extracted": extracted,
+                                         "reused": reused, "errors": errors, "device_meta_read": num_read})
+
 
 
 
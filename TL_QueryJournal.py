@@ -0,0 +1,73 @@
+# TIMELINE TOOL - query the generated journal through its index
+# - entries between two datetimes, entries at a location, entries per day
+# - the index is built by TL_GenerateJsonlEntries. only the matching
+#   journal lines are read, so queries are quick on very large journals
+
+# 20261018 created
+
+#!/usr/bin/env python3
+import sys
+import argparse
+from tl_common import get_volume_path
+from tl_journal import JournalIndex, datetime_key, format_day_key
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Query the generated journal by datetime and location")
+    parser.add_argument("primary_root", help="root of the collection volume with the journal")
+    parser.add_argument("--from", dest="start", default=None,
+                        help="first datetime, e.g. 2008-04 or 2008-04-13_15-42 (default: the first entry)")
+    parser.add_argument("--to", dest="end", default=None,
+                        help="last datetime, all of it: 2008-04 is up to the end of April (default: the last entry)")
+    parser.add_argument("--location", default=None,
+                        help="only entries at this location, not case sensitive")
+    parser.add_argument("--per-day", action="store_true",
+                        help="print the number of entries per day instead of the entries")
+    parser.add_argument("--count", action="store_true",
+                        help="print the number of entries instead of the entries")
+    parser.add_argument("--locations", action="store_true",
+                        help="list the locations in the journal with their number of entries")
+    parser.add_argument("--limit", type=int, default=0,
+                        help="print at most this many entries (default: all)")
+    return parser.parse_args()
+
+def main():
+    args = get_args()
+    primary_root = get_volume_path(args.primary_root)
+    try:
+        index = JournalIndex(primary_root)
+    except OSError:
+        print("Error: no journal index. Run TL_GenerateJsonlEntries first.")
+        sys.exit(1)
+    if not index.is_current():
+        index.close()
+        print("Error: the journal changed since its index was built. Run TL_GenerateJsonlEntries again.")
+        sys.exit(1)
+
+    if args.locations:
+        locations = sorted(index.meta["locations"].values(), key=lambda location: location[1], reverse=True)
+        for _, count, name in locations:
+            print(f"{count:8}  {name or '(no location)'}")
+        index.close()
+        return
+
+    view = index.view(args.location)
+    start_key = datetime_key(args.start) if args.start else None
+    end_key = datetime_key(args.end, end=True) if args.end else None
+    first, stop = view.key_range(start_key, end_key)
+
+    if args.per_day:
+        counts = view.count_per_day(first, stop)
+        for day_key, count in sorted(counts.items()):
+            print(f"{format_day_key(day_key):10}  {count}")
+        print(f"{len(counts)} days, {stop - first} entries")
+    elif args.count:
+        print(stop - first)
+    else:
+        if args.limit:
+            stop = min(stop, first + args.limit)
+        for line in index.read_lines(view.offsets(first, stop)):
+            print(line)
+    index.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+# TIMELINE TOOL - scrub a backup volume against its stored digests
+# - re-reads files and compares them with the sha256 / xxhash stored when
+#   they were copied and verified, to find cards that are silently rotting
+# - reads are throttled, and the position is saved, so a whole card can be
+#   scrubbed a little at a time over many short sessions
+# - reports corrupt and missing files, nothing is changed or deleted
+
+# 20261018 created
+
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import hashlib
+import argparse
+from datetime import datetime
+from tl_common import load_tools_json, save_tools_json, get_relpath_key, get_volume_path
+from tl_hashing import hash_file, new_xxh64, set_io_throttle, DigestCache
+import tl_metrics
+
+SCRUB_STATE_FILENAME = "scrub_state.json"
+REPORT_FILENAME = "_ScriptGeneratedScrubReport.txt"
+# the position is saved after this many files or seconds, whichever is first
+STATE_SAVE_FILES = 50
+STATE_SAVE_SECONDS = 30
+
+def new_pass_state(last_state=None):
+    state = {
+        "position": "",
+        "pass_started": datetime.now().isoformat(timespec="seconds"),
+        "checked": 0,
+        "bytes": 0,
+        "changed": 0,
+        "moved": 0,
+        "problems": [],
+    }
+    if last_state and "last_pass_completed" in last_state:
+        state["last_pass_completed"] = last_state["last_pass_completed"]
+    return state
+
+def read_digests(file_path, sha256, xxh, io_limit=None):
+    """The digests of the file itself for the stored digests that are set, never from the cache"""
+    hashers = []
+    if sha256:
+        hashers.append(hashlib.sha256())
+    if xxh:
+        hashers.append(new_xxh64())
+    return hash_file(file_path, hashers, io_limit)
+
+def find_moved(volume_root, cache, row):
+    """The path a missing entry's file was renamed to in its folder, or None.
+    Only same size files with no digest entry of their own can be the renamed
+    file. A file with an entry is another file, maybe a copy of the same photo.
+    """
+    relpath, size, _, sha256, xxh = row
+    folder = os.path.dirname(os.path.join(volume_root, relpath.replace("/", os.sep)))
+    candidates = []
+    try:
+        with os.scandir(folder) as it:
+            tl_metrics.count("fs_scandir")
+            for entry in it:
+                if entry.is_file():
+                    tl_metrics.count("fs_stat")
+                    if entry.stat().st_size == size:
+                        candidates.append(entry.path)
+    except OSError:
+        return None
+    stored = [d for d in (sha256, xxh) if d]
+    for candidate in candidates:
+        if cache.has_entry(get_relpath_key(candidate, volume_root)):
+            continue
+        try:
+            if read_digests(candidate, sha256, xxh, cache.io_limit) == stored:
+                return candidate
+        except OSError:
+            continue
+    return None
+
+def scrub_entry(volume_root, cache, row):
+    """Check one stored entry against the file on the volume.
+    Returns (status, message). status is "ok", "changed", "moved",
+    "missing", "corrupt" or "unreadable".
+    """
+    relpath, size, mtime_ns, sha256, xxh = row
+    file_path = os.path.join(volume_root, relpath.replace("/", os.sep))
+    try:
+        st = os.stat(file_path)
+        tl_metrics.count("fs_stat")
+    except FileNotFoundError:
+        # a file renamed on this volume leaves its old entry behind.
+        # if it is still there under a name with no entry, it is not missing.
+        # the entries are left as they are, the scrub only reports.
+        if find_moved(volume_root, cache, row):
+            return "moved", None
+        return "missing", f"MISSING: {relpath}"
+    except OSError as e:
+        return "unreadable", f"UNREADABLE: {relpath} ({e})"
+
+    if st.st_size != size or st.st_mtime_ns != mtime_ns:
+        # written since its digest was stored. a new file, not rot.
+        return "changed", None
+
+    try:
+        digests = read_digests(file_path, sha256, xxh, cache.io_limit)
+    except OSError as e:
+        return "unreadable", f"UNREADABLE: {relpath} ({e})"
+    if digests != [d for d in (sha256, xxh) if d]:
+        return "corrupt", f"CORRUPT: {relpath} - content differs from its stored digest"
+    return "ok", None
+
+def write_report(report_path, state):
+    with open(report_path, "w", encoding="utf-8") as f:
+        f.write(f"Scrub pass started {state['pass_started']}, completed {state['last_pass_completed']}\n")
+        f.write(f"{state['checked']} files checked, {state['bytes'] / 1e6:.1f} MB read,"
+                f" {state['changed']} changed since their digest, {state['moved']} moved\n")
+        f.write(f"{len(state['problems'])} problems\n\n")
+        for problem in state["problems"]:
+            f.write(problem + "\n")
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Scrub a backup volume against its stored digests")
+    parser.add_argument("volume_root", help="root of the volume to scrub")
+    parser.add_argument("--mbps", type=float, default=5.0,
+                        help="read at most this many MB/s, 0 for no limit (default 5)")
+    parser.add_argument("--minutes", type=float, default=0,
+                        help="stop after this many minutes, the next run carries on (default: until the pass is done)")
+    parser.add_argument("--restart", action="store_true",
+                        help="forget the saved position and start a new pass")
+    parser.add_argument("--profile", action="store_true",
+                        help="profile the run with cProfile, saved in the tools folder")
+    return parser.parse_args()
+
+def main():
+    args = get_args()
+    tl_metrics.start_run("scrub", args.profile)
+
+    volume_root = get_volume_path(args.volume_root)
+    if not volume_root.exists():
+        print(f"Error: Volume root path does not exist: {volume_root}")
+        sys.exit(1)
+    print(f"Volume root: {volume_root}")
+
+    set_io_throttle(args.mbps)
+    print(f"Reads limited to {args.mbps:g} MB/s" if args.mbps else "Reads not limited")
+
+    state = load_tools_json(volume_root, SCRUB_STATE_FILENAME)
+    if not state or args.restart:
+        state = new_pass_state(state)
+        print("Starting a new scrub pass.")
+    else:
+        print(f"Resuming scrub pass started {state['pass_started']}, {state['checked']} files already checked.")
+
+    cache = DigestCache(volume_root)
+    end_time = time.monotonic() + args.minutes * 60 if args.minutes else None
+    session_checked = 0
+    session_problems = 0
+    unsaved = 0
+    last_save = time.monotonic()
+    pass_done = False
+    out_of_time = False
+
+    try:
+        with tl_metrics.phase("scrub"):
+            while not pass_done and not out_of_time:
+                rows = cache.entries_after(state["position"])
+                if not rows:
+                    pass_done = True
+                for row in rows:
+                    if end_time is not None and time.monotonic() >= end_time:
+                        out_of_time = True
+                        break
+                    status, message = scrub_entry(volume_root, cache, row)
+                    state["position"] = row[0]
+                    state["checked"] += 1
+                    if status == "ok":
+                        state["bytes"] += row[1]
+                    elif status in ("changed", "moved"):
+                        state[status] += 1
+                    else:
+                        state["problems"].append(message)
+                        session_problems += 1
+                        print(message)
+                    session_checked += 1
+                    unsaved += 1
+                    if unsaved >= STATE_SAVE_FILES or time.monotonic() - last_save >= STATE_SAVE_SECONDS:
+                        cache.commit()
+                        save_tools_json(volume_root, SCRUB_STATE_FILENAME, state)
+                        unsaved = 0
+                        last_save = time.monotonic()
+                    if session_checked % 10 == 0:
+                        print(f" → {state['checked']} checked, {len(state['problems'])} problems{tl_metrics.rate_text(session_checked)}", end="\r")
+    except KeyboardInterrupt:
+        print("\nStopped. The position is saved, the next run carries on from here.")
+
+    print(f" ✓ {session_checked} checked this session, {session_problems} problems")
+    if pass_done:
+        state["last_pass_completed"] = datetime.now().isoformat(timespec="seconds")
+        report_path = os.path.join(volume_root, REPORT_FILENAME)
+        try:
+            write_report(report_path, state)
+            print(f"Scrub pass complete. Report saved: {report_path}")
+        except OSError as e:
+            print(f"Error: report not saved: {e}")
+        if state["problems"]:
+            print(f"\n  PROBLEMS IN THIS PASS: {len(state['problems'])}")
+            for problem in state["problems"]:
+                print(problem)
+        finished_state = state
+        state = new_pass_state(state)
+    else:
+        finished_state = state
+        print(f" Pass so far: {state['checked']} files, {len(state['problems'])} problems. Run again to carry on.")
+
+    cache.close()
+    save_tools_json(volume_root, SCRUB_STATE_FILENAME, state)
+    tl_metrics.finish_run(volume_root, {"checked": session_checked, "problems": session_problems,
+                                        "pass_checked": finished_state["checked"], "pass_complete": pass_done})
+
+if __name__ == "__main__":
+    print("COLLECTION TOOL: Scrub backup against stored digests")
+    print("- report only, no files are changed")
+    main()
@@ -0,0 +1,80 @@
+# shared helpers for the TL_ scripts
+# 20261018 created for the on-volume digest cache
+# 20261018 added json state files in the tools folder
+# 20261018 loading or saving state on a read-only volume is not an error
+# 20261018 volume root arguments: a bare drive letter means the drive's root
+# 20261018 shared volume folder dialog, tkinter only imported when it is shown
+
+import os
+import json
+from pathlib import Path
+
+# working folder at the volume root, for caches and state files.
+# it begins with an underscore so the collection scanners skip it.
+TOOLS_DIR_NAME = "_TimelineTools"
+
+def get_volume_path(root_arg):
+    """Path of a volume root given on the command line.
+    The .cmd launchers pass a bare drive like D:, which on its own means the
+    drive's current folder, so it becomes D:\\. Other paths are used as given.
+    """
+    volume_path = Path(root_arg)
+    if volume_path.drive and not volume_path.root:
+        return Path(volume_path.drive + os.sep)
+    return volume_path
+
+def get_tools_dir(volume_root):
+    """Return the tools folder of a volume, creating it if needed"""
+    tools_dir = os.path.join(str(volume_root), TOOLS_DIR_NAME)
+    os.makedirs(tools_dir, exist_ok=True)
+    return tools_dir
+
+def get_relpath_key(file_path, volume_root):
+    """Volume relative path with forward slashes, used as a cache / state key"""
+    return os.path.relpath(str(file_path), str(volume_root)).replace(os.sep, "/")
+
+def load_tools_json(volume_root, filename, default=None):
+    """Load a json state file from the tools folder, default if missing or unreadable"""
+    # not get_tools_dir, loading never creates the folder
+    state_path = os.path.join(str(volume_root), TOOLS_DIR_NAME, filename)
+    try:
+        with open(state_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+def save_tools_json(volume_root, filename, data):
+    """Save a json state file to the tools folder.
+    Written to a temp file then renamed, so an interrupted save keeps the old file.
+    Returns False if it could not be saved, e.g. on a read-only volume.
+    """
+    try:
+        state_path = os.path.join(get_tools_dir(volume_root), filename)
+        temp_path = state_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(temp_path, state_path)
+        return True
+    except OSError as e:
+        print(f"Warning: {filename} not saved: {e}")
+        return False
+
+def ask_volume_root(title):
+    """Ask for a volume with a folder dialog. Returns its root, or None if
+    nothing or a folder that is not a volume root was picked.
+    """
+    import tkinter as tk
+    from tkinter import filedialog
+    root = tk.Tk()
+    root.withdraw()  # Hide the main window
+    volume_root = filedialog.askdirectory(title=title)
+    root.destroy()
+    if volume_root and os.path.ismount(volume_root):
+        return volume_root
+    return None
+
+def remove_tools_file(volume_root, filename):
+    try:
+        os.remove(os.path.join(str(volume_root), TOOLS_DIR_NAME, filename))
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,218 @@
+# camera make / model from file headers, for journal device fields
+# 20261018 created. pure python, reads only the header bytes it needs.
+# 20261018 mdta key reads bounded by their box, a bad key size can not read gigabytes
+# 20261018 the cache records DEVICE_META_VERSION, entries of other readers are dropped
+
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from tl_common import load_tools_json, save_tools_json
+import tl_metrics
+
+DEVICE_META_FILENAME = "device_meta.json"
+# raise this when a file reads to a different make / model than before.
+# cached results and journal entries of other versions are then read again.
+DEVICE_META_VERSION = 1
+JPEG_EXTENSIONS = {".jpg", ".jpeg"}
+MP4_EXTENSIONS = {".mp4", ".mov", ".m4v", ".3gp"}
+
+# below this many files the process pool startup costs more than it saves
+POOL_MIN_FILES = 200
+
+TAG_MAKE = 0x010F
+TAG_MODEL = 0x0110
+
+def _clean_text(raw):
+    return raw.split(b"\0", 1)[0].decode("utf-8", "replace").strip()
+
+def parse_exif_make_model(exif):
+    """Make and Model from the IFD0 of an Exif APP1 payload (after 'Exif\\0\\0')"""
+    if len(exif) < 8:
+        return "", ""
+    if exif[:2] == b"II":
+        endian = "<"
+    elif exif[:2] == b"MM":
+        endian = ">"
+    else:
+        return "", ""
+    ifd_offset = struct.unpack(endian + "I", exif[4:8])[0]
+    if ifd_offset + 2 > len(exif):
+        return "", ""
+    num_entries = struct.unpack(endian + "H", exif[ifd_offset:ifd_offset + 2])[0]
+    found = {}
+    for i in range(num_entries):
+        pos = ifd_offset + 2 + i * 12
+        if pos + 12 > len(exif):
+            break
+        tag, field_type, count = struct.unpack(endian + "HHI", exif[pos:pos + 8])
+        if tag not in (TAG_MAKE, TAG_MODEL) or field_type != 2:
+            continue
+        if count <= 4:
+            raw = exif[pos + 8:pos + 8 + count]
+        else:
+            value_offset = struct.unpack(endian + "I", exif[pos + 8:pos + 12])[0]
+            raw = exif[value_offset:value_offset + count]
+        found[tag] = _clean_text(raw)
+    return found.get(TAG_MAKE, ""), found.get(TAG_MODEL, "")
+
+def read_jpeg_make_model(f):
+    """Walk the JPEG segment headers up to the image data, parsing only APP1 Exif"""
+    if f.read(2) != b"\xff\xd8":
+        return "", ""
+    while True:
+        header = f.read(4)
+        if len(header) < 4 or header[0] != 0xFF:
+            return "", ""
+        marker = header[1]
+        seg_len = struct.unpack(">H", header[2:4])[0]
+        if marker == 0xDA or seg_len < 2:  # start of scan, no more metadata
+            return "", ""
+        if marker == 0xE1:
+            payload = f.read(seg_len - 2)
+            if payload[:6] == b"Exif\0\0":
+                return parse_exif_make_model(payload[6:])
+        else:
+            f.seek(seg_len - 2, os.SEEK_CUR)
+
+def _iter_boxes(f, start, end):
+    """(type, payload start, payload end) of the mp4 boxes between start and end"""
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        box_size, box_type = struct.unpack(">I4s", header)
+        header_len = 8
+        if box_size == 1:
+            box_size = struct.unpack(">Q", f.read(8))[0]
+            header_len = 16
+        elif box_size == 0:
+            box_size = end - pos
+        if box_size < header_len:
+            return
+        yield box_type, pos + header_len, min(pos + box_size, end)
+        pos += box_size
+
+def _read_udta_text(f, start, end):
+    # quicktime user data text: 2 byte length, 2 byte language, then the text
+    f.seek(start)
+    data = f.read(min(end - start, 1024))
+    if len(data) < 4:
+        return ""
+    text_len = struct.unpack(">H", data[:2])[0]
+    return _clean_text(data[4:4 + text_len])
+
+def _read_meta_keys(f, start, end):
+    """Apple mdta metadata: the keys box names each ilst item by index"""
+    keys = []
+    values = {}
+    for box_type, b_start, b_end in _iter_boxes(f, start, end):
+        if box_type == b"keys":
+            f.seek(b_start + 8)  # version, flags, entry count
+            pos = b_start + 8
+            while pos + 8 <= b_end:
+                f.seek(pos)
+                key_size, _ = struct.unpack(">I4s", f.read(8))
+                # the size comes from the file, a malformed one must not
+                # make a huge read. key names are short.
+                if key_size < 8 or pos + key_size > b_end:
+                    break
+                keys.append(f.read(min(key_size - 8, 1024)).decode("utf-8", "replace"))
+                pos += key_size
+        elif box_type == b"ilst":
+            for item_type, i_start, i_end in _iter_boxes(f, b_start, b_end):
+                key_index = struct.unpack(">I", item_type)[0]
+                for data_type, d_start, d_end in _iter_boxes(f, i_start, i_end):
+                    if data_type == b"data":
+                        f.seek(d_start + 8)  # type indicator, locale
+                        values[key_index] = _clean_text(f.read(min(d_end - d_start - 8, 1024)))
+    named = {}
+    for index, value in values.items():
+        if 1 <= index <= len(keys):
+            named[keys[index - 1]] = value
+    return named.get("com.apple.quicktime.make", ""), named.get("com.apple.quicktime.model", "")
+
+def read_mp4_make_model(f, file_size):
+    """Walk box headers to moov, then look in udta and meta for make / model"""
+    make = ""
+    model = ""
+    for box_type, start, end in _iter_boxes(f, 0, file_size):
+        if box_type != b"moov":
+            continue
+        for child_type, c_start, c_end in _iter_boxes(f, start, end):
+            if child_type == b"udta":
+                for item_type, i_start, i_end in _iter_boxes(f, c_start, c_end):
+                    if item_type == b"\xa9mak" and not make:
+                        make = _read_udta_text(f, i_start, i_end)
+                    elif item_type == b"\xa9mod" and not model:
+                        model = _read_udta_text(f, i_start, i_end)
+            elif child_type == b"meta":
+                meta_make, meta_model = _read_meta_keys(f, c_start, c_end)
+                make = make or meta_make
+                model = model or meta_model
+        break
+    return make, model
+
+def read_device_meta(file_path):
+    """(make, model) from the file header, empty strings if not found"""
+    ext = os.path.splitext(file_path)[1].lower()
+    try:
+        with open(file_path, "rb") as f:
+            if ext in JPEG_EXTENSIONS:
+                return read_jpeg_make_model(f)
+            if ext in MP4_EXTENSIONS:
+                return read_mp4_make_model(f, os.fstat(f.fileno()).st_size)
+    except (OSError, struct.error, ValueError):
+        pass
+    return "", ""
+
+def has_device_meta(file_path):
+    ext = os.path.splitext(file_path)[1].lower()
+    return ext in JPEG_EXTENSIONS or ext in MP4_EXTENSIONS
+
+
+class DeviceMetaCache:
+    """Make / model per file, kept in the tools folder of the volume.
+    Entries are reused while the file size and mtime are unchanged, and
+    only if they were read by this DEVICE_META_VERSION.
+    """
+
+    def __init__(self, volume_root):
+        self.volume_root = volume_root
+        saved = load_tools_json(volume_root, DEVICE_META_FILENAME, {})
+        self.entries = saved.get("entries", {}) if saved.get("version") == DEVICE_META_VERSION else {}
+
+    def lookup(self, collection_file):
+        cached = self.entries.get(collection_file.relpath)
+        if cached and cached[0] == collection_file.size and cached[1] == collection_file.mtime_ns:
+            return cached[2], cached[3]
+        return None
+
+    def fill(self, collection_files, max_workers=None):
+        """Read make / model for the files that are not cached yet.
+        Many files are read on a process pool, the parsing is python bound.
+        """
+        missing = [f for f in collection_files if has_device_meta(f.path) and self.lookup(f) is None]
+        paths = [f.path for f in missing]
+        # counted here, counts made in the pool processes are not kept
+        if paths:
+            tl_metrics.count("fs_open", len(paths))
+        if len(paths) >= POOL_MIN_FILES:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                results = list(executor.map(read_device_meta, paths, chunksize=64))
+        else:
+            results = [read_device_meta(path) for path in paths]
+        for collection_file, (make, model) in zip(missing, results):
+            self.entries[collection_file.relpath] = [collection_file.size, collection_file.mtime_ns, make, model]
+        return len(missing)
+
+    def get(self, collection_file):
+        return self.lookup(collection_file) or ("", "")
+
+    def save(self, collection_files):
+        # only files still in the collection are kept
+        keep = set(f.relpath for f in collection_files)
+        self.entries = {k: v for k, v in self.entries.items() if k in keep}
+        save_tools_json(self.volume_root, DEVICE_META_FILENAME,
+                        {"version": DEVICE_META_VERSION, "entries": self.entries})
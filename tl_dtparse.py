@@ -0,0 +1,112 @@
+# timeline filename datetime prefix parser, shared by the TL_ scripts
+# 20261018 one anchored pattern replaces the per-script pattern lists
+# 20261018 PARSER_VERSION, so stored journal entries are made again after a change
+#
+# accepted prefixes, always followed by a space:
+#   2008-04-13 / 2008-04 / 2008
+#   2008-04-13_15 / 2008-04-13 15-42 / 2008-04-13_15-42-56 / 2008-04-13_15-42-56.123
+#   any of the timed forms with a utc offset: 2008-04-12_12-17-56+0700
+
+import re
+from collections import namedtuple
+
+# raise this when a filename parses to a different result than before.
+# the journal keeps entries of unchanged files, and makes them again when it changes.
+PARSER_VERSION = 1
+
+# length is the number of characters of the prefix, including the space after it
+DatetimePrefix = namedtuple("DatetimePrefix", ["date", "time", "utc_offset", "length"])
+
+# a time is only allowed after a full date, checked by the lookbehind
+DATETIME_PREFIX_RE = re.compile(
+    r"(?P<date>\d{4}(?:-\d{2}){0,2})"
+    r"(?:(?<=\d{4}-\d{2}-\d{2})[ _]"
+    r"(?P<time>\d{2}(?:[-_]\d{2}(?:[-_]\d{2}(?:\.\d{3,6})?)?)?)"
+    r"(?P<utc_offset>[\+-]\d{4})?)? "
+)
+_match_prefix = DATETIME_PREFIX_RE.match
+
+def parse_timeline_datetime(filename):
+    """DatetimePrefix of a filename, or None if it does not begin with a date.
+    time and utc_offset are None when the name has none.
+    """
+    match = _match_prefix(filename)
+    if match is None:
+        return None
+    # the three named groups are the only capturing groups
+    return DatetimePrefix(*match.groups(), match.end())
+
+def get_datetime_prefix(filename, require_minutes=False):
+    """The datetime prefix of a filename including its trailing space, or "".
+    require_minutes only accepts names with at least hours and minutes.
+    """
+    match = _match_prefix(filename)
+    if match is None:
+        return ""
+    if require_minutes:
+        time = match.group("time")
+        if time is None or len(time) < 5:
+            return ""
+    return match.group()
+
+
+def _make_benchmark_names(count, seed=1):
+    import random
+    rng = random.Random(seed)
+    forms = [
+        "{y}-{m}-{d}_{H}-{M} {desc}.mp4",
+        "{y}-{m}-{d}_{H}-{M}-{S}+0700 {desc}.jpg",
+        "{y}-{m}-{d} {H}-{M}-{S}.123 {desc}.jpg",
+        "{y}-{m}-{d} {desc}.png",
+        "{y}-{m} {desc}.pdf",
+        "IMG_{H}{M}{S} {desc}.jpg",
+        "{desc} {y}.txt",
+    ]
+    names = []
+    for _ in range(count):
+        names.append(rng.choice(forms).format(
+            y=rng.randint(1990, 2026), m=f"{rng.randint(1, 12):02}", d=f"{rng.randint(1, 28):02}",
+            H=f"{rng.randint(0, 23):02}", M=f"{rng.randint(0, 59):02}", S=f"{rng.randint(0, 59):02}",
+            desc=rng.choice(["TH Chiang Mai - market", "beach", "NZ Auckland - harbour walk"])))
+    return names
+
+def _old_pattern_list():
+    # the six patterns the rename tool tried in turn before this module
+    return [
+        re.compile(r"^\d{4}-\d{2}-\d{2}[ _]\d{2}[-_]\d{2}[-_]\d{2}\.\d{3,6}[\+-]\d{4} "),
+        re.compile(r"^\d{4}-\d{2}-\d{2}[ _]\d{2}[-_]\d{2}[-_]\d{2}\.\d{3,6} "),
+        re.compile(r"^\d{4}-\d{2}-\d{2}[ _]\d{2}[-_]\d{2}[-_]\d{2}[\+-]\d{4} "),
+        re.compile(r"^\d{4}-\d{2}-\d{2}[ _]\d{2}[-_]\d{2}[-_]\d{2} "),
+        re.compile(r"^\d{4}-\d{2}-\d{2}[ _]\d{2}[-_]\d{2}[\+-]\d{4} "),
+        re.compile(r"^\d{4}-\d{2}-\d{2}[ _]\d{2}[-_]\d{2} "),
+    ]
+
+def _old_prefix(filename, patterns):
+    for pattern in patterns:
+        match = pattern.match(filename)
+        if match:
+            return match.group()
+    return ""
+
+def run_benchmark(count=1000000):
+    """Per filename cost of the parser against the old pattern list"""
+    import time
+    names = _make_benchmark_names(count)
+    patterns = _old_pattern_list()
+    timings = [
+        ("old pattern list", lambda name: _old_prefix(name, patterns)),
+        ("get_datetime_prefix", lambda name: get_datetime_prefix(name, require_minutes=True)),
+        ("parse_timeline_datetime", parse_timeline_datetime),
+    ]
+    mismatches = sum(1 for name in names
+                     if _old_prefix(name, patterns) != get_datetime_prefix(name, require_minutes=True))
+    print(f"{count} synthetic names, {mismatches} differ from the old pattern list")
+    for label, func in timings:
+        start = time.perf_counter()
+        for name in names:
+            func(name)
+        elapsed = time.perf_counter() - start
+        print(f" {label}: {elapsed:.2f}s, {elapsed / count * 1e9:.0f} ns per name")
+
+if __name__ == "__main__":
+    run_benchmark()
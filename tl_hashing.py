@@ -0,0 +1,439 @@
+# file hashing helpers shared by the backup scripts
+# 20261018 moved compute_sha256 / compute_xxhash here, added DigestCache
+# 20261018 added single pass copy with hashing
+# 20261018 added optional per-device io limits for concurrent copies
+# 20261018 all hashers stream through one reusable, configurable read buffer
+# 20261018 added an optional bandwidth throttle, to mimic slow cards in benchmarks
+# 20261018 bytes and file calls are counted in the run metrics
+# 20261018 separate write chunk size
+# 20261018 added a head / tail partial hash for ruling out duplicates cheaply
+# 20261018 added a sampled hash, a fixed few MB per file whatever its size
+# 20261018 copy to several destinations from one read of the source
+# 20261018 xxhash is imported on first use
+# 20261018 DigestCache can list its entries in relpath order, for the scrub
+# 20261018 sync_files, for syncing a batch of copies after they are closed
+
+import os
+import shutil
+import contextlib
+import sqlite3
+import hashlib
+import threading
+import time
+import random
+import tl_metrics
+from tl_common import get_tools_dir, get_relpath_key
+
+DIGEST_CACHE_FILENAME = "digest_cache.sqlite"
+
+def new_xxh64():
+    # imported here, so tools that never hash do not pay for the import at startup
+    import xxhash
+    return xxhash.xxh64()
+
+# bytes per read when hashing and copying. large reads cut the python call
+# overhead per byte, and memory stays at one buffer per file whatever its size.
+read_buffer_size = 1024 * 1024
+
+# bytes per write when copying. flash cards write fastest in their own
+# allocation unit size, which can differ from the best read size.
+write_chunk_size = 1024 * 1024
+
+def set_read_buffer_size(size_bytes):
+    global read_buffer_size
+    read_buffer_size = max(64 * 1024, int(size_bytes))
+
+def set_write_chunk_size(size_bytes):
+    global write_chunk_size
+    write_chunk_size = max(64 * 1024, int(size_bytes))
+
+class IoThrottle:
+    """Limits the bytes per second read / written through it, like a slow card.
+    Each chunk takes the device for size / rate seconds, so threads queue up
+    behind each other the way they do on a real card.
+    """
+
+    def __init__(self, bytes_per_second):
+        self.bytes_per_second = float(bytes_per_second)
+        self.lock = threading.Lock()
+        self.next_free = time.monotonic()
+
+    def wait(self, num_bytes):
+        with self.lock:
+            now = time.monotonic()
+            done_at = max(now, self.next_free) + num_bytes / self.bytes_per_second
+            self.next_free = done_at
+        delay = done_at - now
+        if delay > 0:
+            time.sleep(delay)
+
+# shared by all reads and writes below. None is no throttle.
+io_throttle = None
+
+def set_io_throttle(mb_per_second):
+    """Throttle file io to mb_per_second (MB = 1000000 bytes), 0 or None turns it off"""
+    global io_throttle
+    io_throttle = IoThrottle(mb_per_second * 1000 * 1000) if mb_per_second else None
+
+def io_slot(io_limit):
+    """Hold one of a device's io slots for a single read or write.
+    io_limit is a threading.Semaphore shared by all users of a device, or None
+    """
+    if io_limit is None:
+        return contextlib.nullcontext()
+    return io_limit
+
+def hash_file(file_path, hashers, io_limit=None):
+    """Stream a file through hash objects, reusing one read buffer.
+    Returns the hexdigest of each hasher.
+    """
+    buf = bytearray(read_buffer_size)
+    view = memoryview(buf)
+    tl_metrics.count("fs_open")
+    with open(file_path, 'rb', buffering=0) as f:
+        while True:
+            with io_slot(io_limit):
+                num_read = f.readinto(buf)
+            if not num_read:
+                break
+            tl_metrics.add_read(num_read)
+            if io_throttle is not None:
+                io_throttle.wait(num_read)
+            for hasher in hashers:
+                hasher.update(view[:num_read])
+    return [hasher.hexdigest() for hasher in hashers]
+
+def compute_sha256(file_path, io_limit=None):
+    return hash_file(file_path, [hashlib.sha256()], io_limit)[0]
+
+def compute_xxhash(file_path, io_limit=None):
+    return hash_file(file_path, [new_xxh64()], io_limit)[0]
+
+def compute_digests(file_path, io_limit=None):
+    """sha256 and xxhash of a file, from one read"""
+    sha256, xxh = hash_file(file_path, [hashlib.sha256(), new_xxh64()], io_limit)
+    return sha256, xxh
+
+def compute_partial_hash(file_path, block_size=64 * 1024, io_limit=None):
+    """xxhash of the size, first block and last block of a file.
+    Files up to two blocks long are hashed whole, in one read.
+    Different partial hashes mean different files, equal ones prove nothing.
+    """
+    hasher = new_xxh64()
+    tl_metrics.count("fs_open")
+    # buffered, so read(n) returns all n bytes
+    with open(file_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        hasher.update(size.to_bytes(8, "little"))
+        with io_slot(io_limit):
+            if size <= 2 * block_size:
+                blocks = [f.read(size)]
+            else:
+                head = f.read(block_size)
+                f.seek(size - block_size)
+                blocks = [head, f.read(block_size)]
+    for block in blocks:
+        tl_metrics.add_read(len(block))
+        if io_throttle is not None:
+            io_throttle.wait(len(block))
+        hasher.update(block)
+    return hasher.hexdigest()
+
+# sampled hash: head, middle, tail and SAMPLE_RANDOM_BLOCKS more blocks
+SAMPLE_BLOCK_SIZE = 256 * 1024
+SAMPLE_RANDOM_BLOCKS = 5
+
+def get_sample_offsets(size, block_size=SAMPLE_BLOCK_SIZE, num_random=SAMPLE_RANDOM_BLOCKS):
+    """Block offsets to sample in a file of size bytes.
+    The random offsets are seeded by the size, so two files of one size
+    are sampled at the same places.
+    """
+    last = size - block_size
+    offsets = {0, last // 2, last}
+    rng = random.Random(size)
+    for _ in range(num_random):
+        offsets.add(rng.randrange(0, last + 1))
+    return sorted(offsets)
+
+def compute_sample_hash(file_path, io_limit=None):
+    """xxhash of the size and a fixed set of blocks of a file.
+    Small files are hashed whole. Different sample hashes mean different
+    files, equal ones mean the files agree everywhere that was sampled.
+    """
+    hasher = new_xxh64()
+    tl_metrics.count("fs_open")
+    with open(file_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        hasher.update(size.to_bytes(8, "little"))
+        if size <= (3 + SAMPLE_RANDOM_BLOCKS) * SAMPLE_BLOCK_SIZE:
+            offsets = [0]
+            block_size = size
+        else:
+            offsets = get_sample_offsets(size)
+            block_size = SAMPLE_BLOCK_SIZE
+        for offset in offsets:
+            with io_slot(io_limit):
+                f.seek(offset)
+                block = f.read(block_size)
+            tl_metrics.add_read(len(block))
+            if io_throttle is not None:
+                io_throttle.wait(len(block))
+            hasher.update(offset.to_bytes(8, "little"))
+            hasher.update(block)
+    return hasher.hexdigest()
+
+def copy_file_with_digests(src_file, dest_file, src_io_limit=None, dest_io_limit=None, fsync=True):
+    """Copy a file like shutil.copy2, hashing the bytes as they are written.
+    The source is read once. Returns the (sha256, xxhash) of the source bytes.
+    Hashing happens outside the io slots, so other files can use the devices.
+    Writes go out in write_chunk_size pieces. With fsync the copy is synced
+    on its write handle before it is closed, no second open is needed.
+    """
+    sha256, xxh, failures = copy_file_to_many(src_file, [dest_file], src_io_limit, [dest_io_limit], fsync)
+    if failures:
+        raise failures[0]
+    return sha256, xxh
+
+def copy_file_to_many(src_file, dest_files, src_io_limit=None, dest_io_limits=None, fsync=True):
+    """Copy a file to several destinations from one read of the source.
+    Each chunk is hashed once and written to every destination still open.
+    A destination that fails is closed and left out, the others go on.
+    Returns (sha256, xxhash, failures), failures maps a dest index to its OSError.
+    sha256 and xxhash are None when every destination failed, as the source
+    was then not read to the end. Without fsync the caller syncs the copies
+    later, a batch at a time, see sync_files.
+    """
+    if dest_io_limits is None:
+        dest_io_limits = [None] * len(dest_files)
+    sha256 = hashlib.sha256()
+    xxh = new_xxh64()
+    buf = bytearray(read_buffer_size)
+    view = memoryview(buf)
+    failures = {}
+    fdests = {}
+    read_to_end = False
+    with contextlib.ExitStack() as stack:
+        tl_metrics.count("fs_open")
+        fsrc = stack.enter_context(open(src_file, 'rb', buffering=0))
+        for i, dest_file in enumerate(dest_files):
+            try:
+                tl_metrics.count("fs_open")
+                fdests[i] = stack.enter_context(open(dest_file, 'wb', buffering=write_chunk_size))
+            except OSError as e:
+                failures[i] = e
+
+        def fail(i, e):
+            failures[i] = e
+            fdest = fdests.pop(i)
+            try:
+                fdest.close()
+            except OSError:
+                pass
+
+        while fdests:
+            with io_slot(src_io_limit):
+                num_read = fsrc.readinto(buf)
+            if not num_read:
+                read_to_end = True
+                break
+            tl_metrics.add_read(num_read)
+            if io_throttle is not None:
+                io_throttle.wait((1 + len(fdests)) * num_read)  # all on one simulated card
+            chunk = view[:num_read]
+            sha256.update(chunk)
+            xxh.update(chunk)
+            for i, fdest in list(fdests.items()):
+                try:
+                    with io_slot(dest_io_limits[i]):
+                        for offset in range(0, num_read, write_chunk_size):
+                            fdest.write(chunk[offset:offset + write_chunk_size])
+                    tl_metrics.add_written(num_read)
+                except OSError as e:
+                    fail(i, e)
+
+        for i, fdest in list(fdests.items()):
+            try:
+                fdest.flush()
+                if fsync:
+                    os.fsync(fdest.fileno())
+                    tl_metrics.count("fs_fsync")
+            except OSError as e:
+                fail(i, e)
+
+    for i, dest_file in enumerate(dest_files):
+        if i not in failures:
+            try:
+                tl_metrics.count("fs_copystat")
+                shutil.copystat(src_file, dest_file)
+            except OSError as e:
+                failures[i] = e
+    if not read_to_end:
+        return None, None, failures
+    return sha256.hexdigest(), xxh.hexdigest(), failures
+
+def sync_files(file_paths):
+    """Flush a batch of written and closed files to their volumes.
+    One os.sync() where the OS has it. Windows has none, there each file
+    is opened for writing and fsynced. Returns {path: OSError} of the failed.
+    """
+    failures = {}
+    if not file_paths:
+        return failures
+    if hasattr(os, "sync"):
+        tl_metrics.count("fs_sync")
+        os.sync()
+        return failures
+    for file_path in file_paths:
+        try:
+            tl_metrics.count("fs_open")
+            with open(file_path, "rb+") as f:
+                os.fsync(f.fileno())
+                tl_metrics.count("fs_fsync")
+        except OSError as e:
+            failures[file_path] = e
+    return failures
+
+
+class DigestCache:
+    """Persistent sha256 / xxhash digests for the files of one volume.
+
+    Stored as sqlite in the tools folder at the volume root.
+    Entries are keyed by volume relative path and are only reused
+    while the file size and mtime are unchanged.
+    io_limit is the volume's io slots (a Semaphore) when used from threads.
+    """
+
+    def __init__(self, volume_root, io_limit=None):
+        self.volume_root = str(volume_root)
+        self.io_limit = io_limit
+        self.lock = threading.Lock()
+        self.uncommitted = 0
+        try:
+            cache_path = os.path.join(get_tools_dir(self.volume_root), DIGEST_CACHE_FILENAME)
+            self.conn = sqlite3.connect(cache_path, check_same_thread=False)
+            self._create_table()
+        except (OSError, sqlite3.Error) as e:
+            # read-only or full volume. still works, just not persistent.
+            print(f"Warning: digest cache not persistent for {self.volume_root}: {e}")
+            self.conn = sqlite3.connect(":memory:", check_same_thread=False)
+            self._create_table()
+
+    def _create_table(self):
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS digests ("
+            " relpath TEXT PRIMARY KEY,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " sha256 TEXT,"
+            " xxhash TEXT)"
+        )
+        self.conn.commit()
+
+    def lookup(self, relpath, size, mtime_ns):
+        """Return (sha256, xxhash) for a still valid entry, else (None, None)"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT size, mtime_ns, sha256, xxhash FROM digests WHERE relpath = ?",
+                (relpath,)
+            ).fetchone()
+        if row is None or row[0] != size or row[1] != mtime_ns:
+            return None, None
+        return row[2], row[3]
+
+    def store(self, relpath, size, mtime_ns, sha256=None, xxh=None):
+        """Save digests. Digests not given are kept only if size and mtime still match"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT size, mtime_ns, sha256, xxhash FROM digests WHERE relpath = ?",
+                (relpath,)
+            ).fetchone()
+            if row is not None and row[0] == size and row[1] == mtime_ns:
+                sha256 = sha256 or row[2]
+                xxh = xxh or row[3]
+            self.conn.execute(
+                "INSERT OR REPLACE INTO digests (relpath, size, mtime_ns, sha256, xxhash)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (relpath, size, mtime_ns, sha256, xxh)
+            )
+            self.uncommitted += 1
+            if self.uncommitted >= 100:
+                self.conn.commit()
+                self.uncommitted = 0
+
+    def store_file(self, file_path, sha256=None, xxh=None):
+        """Save digests that were computed from the current file content"""
+        st = os.stat(file_path)
+        tl_metrics.count("fs_stat")
+        relpath = get_relpath_key(file_path, self.volume_root)
+        self.store(relpath, st.st_size, st.st_mtime_ns, sha256, xxh)
+
+    def cached(self, file_path):
+        """(sha256, xxhash) of a file if cached and still valid, else (None, None). Never reads the file"""
+        st = os.stat(file_path)
+        tl_metrics.count("fs_stat")
+        relpath = get_relpath_key(file_path, self.volume_root)
+        return self.lookup(relpath, st.st_size, st.st_mtime_ns)
+
+    def sha256(self, file_path):
+        """sha256 of a file, from the cache when size and mtime are unchanged"""
+        st = os.stat(file_path)
+        tl_metrics.count("fs_stat")
+        relpath = get_relpath_key(file_path, self.volume_root)
+        sha256, _ = self.lookup(relpath, st.st_size, st.st_mtime_ns)
+        if sha256 is None:
+            sha256 = compute_sha256(file_path, self.io_limit)
+            self.store(relpath, st.st_size, st.st_mtime_ns, sha256=sha256)
+        return sha256
+
+    def xxhash(self, file_path):
+        """xxhash of a file, from the cache when size and mtime are unchanged"""
+        st = os.stat(file_path)
+        tl_metrics.count("fs_stat")
+        relpath = get_relpath_key(file_path, self.volume_root)
+        _, xxh = self.lookup(relpath, st.st_size, st.st_mtime_ns)
+        if xxh is None:
+            xxh = compute_xxhash(file_path, self.io_limit)
+            self.store(relpath, st.st_size, st.st_mtime_ns, xxh=xxh)
+        return xxh
+
+    def digests(self, file_path):
+        """(sha256, xxhash) of a file. Both are computed in one read if either is missing"""
+        st = os.stat(file_path)
+        tl_metrics.count("fs_stat")
+        relpath = get_relpath_key(file_path, self.volume_root)
+        sha256, xxh = self.lookup(relpath, st.st_size, st.st_mtime_ns)
+        if sha256 is None or xxh is None:
+            sha256, xxh = compute_digests(file_path, self.io_limit)
+            self.store(relpath, st.st_size, st.st_mtime_ns, sha256, xxh)
+        return sha256, xxh
+
+    def entries_after(self, relpath, limit=500):
+        """Up to limit stored entries after relpath, in relpath order.
+        Rows are (relpath, size, mtime_ns, sha256, xxhash)
+        """
+        with self.lock:
+            return self.conn.execute(
+                "SELECT relpath, size, mtime_ns, sha256, xxhash FROM digests"
+                " WHERE relpath > ? ORDER BY relpath LIMIT ?",
+                (relpath, limit)
+            ).fetchall()
+
+    def has_entry(self, relpath):
+        """True if relpath has an entry, valid or not"""
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM digests WHERE relpath = ?", (relpath,)).fetchone() is not None
+
+    def remove(self, relpath):
+        with self.lock:
+            self.conn.execute("DELETE FROM digests WHERE relpath = ?", (relpath,))
+            self.uncommitted += 1
+
+    def commit(self):
+        with self.lock:
+            self.conn.commit()
+            self.uncommitted = 0
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
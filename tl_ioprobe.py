@@ -0,0 +1,96 @@
+# chunk size probe for removable flash volumes
+# 20261018 created. times reads / writes at a few chunk sizes, once per volume
+# 20261018 a read-only volume is probed each run, its result can not be saved
+
+import os
+import time
+from tl_common import get_tools_dir, load_tools_json, save_tools_json
+
+IO_PROBE_FILENAME = "io_probe.json"
+PROBE_CHUNK_SIZES = [256 * 1024, 1024 * 1024, 4 * 1024 * 1024, 8 * 1024 * 1024]
+# bytes moved per chunk size. enough to get past the card's cache, short enough to not be noticed
+PROBE_BYTES = 16 * 1024 * 1024
+
+def pick_chunk_size(mbps_by_size):
+    """Smallest chunk size within 5% of the fastest"""
+    best = max(mbps_by_size.values())
+    for size in sorted(mbps_by_size):
+        if mbps_by_size[size] >= best * 0.95:
+            return size
+
+def probe_write(volume_root):
+    """MB/s writing PROBE_BYTES at each chunk size, to a temp file in the tools folder"""
+    probe_path = os.path.join(get_tools_dir(volume_root), "io_probe.tmp")
+    data = os.urandom(max(PROBE_CHUNK_SIZES))
+    view = memoryview(data)
+    results = {}
+    try:
+        for size in PROBE_CHUNK_SIZES:
+            start = time.perf_counter()
+            with open(probe_path, "wb", buffering=0) as f:
+                for _ in range(PROBE_BYTES // size):
+                    f.write(view[:size])
+                os.fsync(f.fileno())
+            results[size] = PROBE_BYTES / 1e6 / (time.perf_counter() - start)
+            os.remove(probe_path)
+    finally:
+        if os.path.exists(probe_path):
+            os.remove(probe_path)
+    return results
+
+def probe_read(file_paths):
+    """MB/s reading PROBE_BYTES at each chunk size, from file_paths.
+    Each size reads bytes the others have not, so the os cache does not help.
+    Returns {} if the files are too small for the probe.
+    """
+    regions = []
+    for file_path in file_paths:
+        try:
+            size = os.path.getsize(file_path)
+        except OSError:
+            continue
+        for offset in range(0, size - PROBE_BYTES + 1, PROBE_BYTES):
+            regions.append((file_path, offset))
+        if len(regions) >= len(PROBE_CHUNK_SIZES):
+            break
+    if len(regions) < len(PROBE_CHUNK_SIZES):
+        return {}
+    results = {}
+    buf = bytearray(max(PROBE_CHUNK_SIZES))
+    view = memoryview(buf)
+    for size, (file_path, offset) in zip(PROBE_CHUNK_SIZES, regions):
+        start = time.perf_counter()
+        with open(file_path, "rb", buffering=0) as f:
+            f.seek(offset)
+            remaining = PROBE_BYTES
+            while remaining > 0:
+                num_read = f.readinto(view[:min(size, remaining)])
+                if not num_read:
+                    break
+                remaining -= num_read
+        results[size] = PROBE_BYTES / 1e6 / (time.perf_counter() - start)
+    return results
+
+def get_chunk_size(volume_root, kind, probe_func, reprobe=False):
+    """Chunk size for reads or writes on a volume, from its saved probe.
+    The volume is probed if it has no saved result or reprobe is set.
+    Returns None if the probe could not run.
+    """
+    saved = load_tools_json(volume_root, IO_PROBE_FILENAME, {})
+    if not reprobe and kind in saved:
+        return saved[kind]["chunk_size"]
+    try:
+        mbps_by_size = probe_func()
+    except OSError as e:
+        print(f"Warning: {kind} probe failed on {volume_root}: {e}")
+        return None
+    if not mbps_by_size:
+        return None
+    chunk_size = pick_chunk_size(mbps_by_size)
+    rates = ", ".join(f"{size // 1024}KB {mbps:.1f}" for size, mbps in sorted(mbps_by_size.items()))
+    print(f" {kind} probe {volume_root}: {rates} MB/s, using {chunk_size // 1024}KB")
+    # a write-protected card can still be read. the probe is just not kept.
+    if os.access(str(volume_root), os.W_OK):
+        saved[kind] = {"chunk_size": chunk_size, "mbps": {str(size): round(mbps, 2) for size, mbps in mbps_by_size.items()}}
+        save_tools_json(volume_root, IO_PROBE_FILENAME, saved)
+    return chunk_size
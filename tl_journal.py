@@ -0,0 +1,275 @@
+# journal file helpers for TL_GenerateJsonlEntries
+# 20261018 created, sorted jsonl writer with bounded memory
+# 20261018 datetime and location index of the journal, for TL_QueryJournal
+
+import os
+import re
+import json
+import mmap
+import heapq
+import struct
+import tempfile
+from tl_common import TOOLS_DIR_NAME, get_tools_dir, load_tools_json, save_tools_json
+
+JOURNAL_FILENAME = "_ScriptGeneratedJournalEntries.jsonl"
+
+# index files in the tools folder. the .idx files are fixed size records of
+# (datetime key, byte offset of the journal line), so they can be binary searched
+# in place. the json has the journal size / mtime it was built from, and where
+# each location's records are in the location index.
+INDEX_META_FILENAME = "journal_index.json"
+DATETIME_INDEX_FILENAME = "journal_datetime.idx"
+LOCATION_INDEX_FILENAME = "journal_location.idx"
+INDEX_RECORD = struct.Struct("<qq")
+
+
+class SortedLinesWriter:
+    """Writes lines to a file in sorted order, with bounded memory.
+
+    Lines are buffered until run_size, then sorted and written to a temp
+    run file in the tools folder. finish() merges the runs into a temp file
+    next to the output and renames it over the output, so a failed run
+    never leaves a half written file.
+    Output is the lines joined by newlines, no newline after the last line.
+    """
+
+    def __init__(self, output_path, volume_root, run_size=100000):
+        self.output_path = str(output_path)
+        self.run_dir = get_tools_dir(volume_root)
+        self.run_size = run_size
+        self.buffer = []
+        self.run_paths = []
+        self.count = 0
+
+    def add(self, line):
+        self.buffer.append(line)
+        self.count += 1
+        if len(self.buffer) >= self.run_size:
+            self._write_run()
+
+    def _write_run(self):
+        self.buffer.sort()
+        fd, run_path = tempfile.mkstemp(prefix="journal_run_", suffix=".tmp", dir=self.run_dir)
+        self.run_paths.append(run_path)
+        with open(fd, "w", encoding="utf-8", newline="\n") as f:
+            for line in self.buffer:
+                f.write(line)
+                f.write("\n")
+        self.buffer = []
+
+    def _read_run(self, f):
+        for line in f:
+            yield line.rstrip("\n")
+
+    def finish(self):
+        """Merge all lines into the output file"""
+        self.buffer.sort()
+        temp_path = self.output_path + ".tmp"
+        run_files = [open(p, "r", encoding="utf-8", newline="\n") for p in self.run_paths]
+        try:
+            merged = heapq.merge(self.buffer, *(self._read_run(f) for f in run_files))
+            with open(temp_path, "w", encoding="utf-8") as out:
+                for i, line in enumerate(merged):
+                    if i:
+                        out.write("\n")
+                    out.write(line)
+            os.replace(temp_path, self.output_path)
+        finally:
+            for f in run_files:
+                f.close()
+            self.discard()
+
+    def discard(self):
+        """Remove the temp run files, the output is left as it was"""
+        for run_path in self.run_paths:
+            try:
+                os.remove(run_path)
+            except OSError:
+                pass
+        self.run_paths = []
+        self.buffer = []
+        temp_path = self.output_path + ".tmp"
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def datetime_key(date, time=None, end=False):
+    """Sortable integer YYYYMMDDHHMMSS of a journal date and time.
+    Parts not given are 00, or 99 with end, so a key range of a day or
+    month covers all of it. Fractions of a second and the utc offset are left out.
+    """
+    digits = "".join(re.findall(r"\d+", date or ""))
+    digits += "".join(re.findall(r"\d+", (time or "").split(".")[0]))
+    digits = digits[:14]
+    return int(digits.ljust(14, "9" if end else "0"))
+
+def format_day_key(day_key):
+    """Day of a key as text, leaving off the parts an entry did not have"""
+    text = str(day_key)
+    year, month, day = text[:4], text[4:6], text[6:8]
+    if month == "00":
+        return year
+    if day == "00":
+        return f"{year}-{month}"
+    return f"{year}-{month}-{day}"
+
+def _write_records(index_path, records):
+    temp_path = index_path + ".tmp"
+    with open(temp_path, "wb") as f:
+        pack = INDEX_RECORD.pack
+        f.write(b"".join(pack(key, offset) for key, offset in records))
+    os.replace(temp_path, index_path)
+
+def build_journal_index(volume_root, journal_path):
+    """Index a journal by datetime and by location.
+    Reads the journal once. The meta json is saved last, so an interrupted
+    build is seen as out of date rather than used.
+    Returns the number of entries indexed.
+    """
+    records = []
+    by_location = {}
+    location_names = {}
+    offset = 0
+    with open(journal_path, "rb") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+                key = datetime_key(entry["date"], entry["time"])
+            except (ValueError, KeyError):
+                offset += len(line)
+                continue
+            records.append((key, offset))
+            location_name = entry.get("location") or ""
+            location = location_name.casefold()
+            by_location.setdefault(location, []).append((key, offset))
+            location_names.setdefault(location, location_name)
+            offset += len(line)
+
+    tools_dir = get_tools_dir(volume_root)
+    records.sort()
+    _write_records(os.path.join(tools_dir, DATETIME_INDEX_FILENAME), records)
+
+    locations = {}
+    location_records = []
+    for location in sorted(by_location):
+        group = sorted(by_location[location])
+        locations[location] = [len(location_records), len(group), location_names[location]]
+        location_records.extend(group)
+    _write_records(os.path.join(tools_dir, LOCATION_INDEX_FILENAME), location_records)
+
+    st = os.stat(journal_path)
+    save_tools_json(volume_root, INDEX_META_FILENAME, {
+        "journal_size": st.st_size,
+        "journal_mtime_ns": st.st_mtime_ns,
+        "entries": len(records),
+        "locations": locations,
+    })
+    return len(records)
+
+
+def _map_index_file(index_path):
+    """Read only view of an index file. Pages are read as the searches touch them"""
+    with open(index_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class RecordView:
+    """Binary search over a slice of (key, offset) records in an index file's bytes"""
+
+    def __init__(self, data, start=0, count=None):
+        self.data = data
+        self.start = start
+        self.stop = len(data) // INDEX_RECORD.size if count is None else start + count
+
+    def key(self, i):
+        return INDEX_RECORD.unpack_from(self.data, i * INDEX_RECORD.size)[0]
+
+    def bisect_left(self, key, lo=None):
+        lo = self.start if lo is None else lo
+        hi = self.stop
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def bisect_right(self, key, lo=None):
+        lo = self.start if lo is None else lo
+        hi = self.stop
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.key(mid) <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def key_range(self, start_key=None, end_key=None):
+        """(first, stop) record numbers of the records with start_key <= key <= end_key"""
+        first = self.start if start_key is None else self.bisect_left(start_key)
+        stop = self.stop if end_key is None else self.bisect_right(end_key, first)
+        return first, stop
+
+    def offsets(self, first, stop):
+        size = INDEX_RECORD.size
+        return [offset for _, offset in INDEX_RECORD.iter_unpack(self.data[first * size:stop * size])]
+
+    def count_per_day(self, first, stop):
+        """{day key: count} of the records from first to stop.
+        One binary search per day, the records in between are not read.
+        """
+        counts = {}
+        i = first
+        while i < stop:
+            day = self.key(i) // 1000000
+            next_i = min(self.bisect_left((day + 1) * 1000000, i), stop)
+            counts[day] = next_i - i
+            i = next_i
+        return counts
+
+
+class JournalIndex:
+    """Queries of a journal through its index files. The journal lines are
+    read by seeking to their offsets, the rest of the journal is never read.
+    """
+
+    def __init__(self, volume_root):
+        self.journal_path = os.path.join(str(volume_root), JOURNAL_FILENAME)
+        self.meta = load_tools_json(volume_root, INDEX_META_FILENAME)
+        # queries only read, the volume may be write-protected
+        tools_dir = os.path.join(str(volume_root), TOOLS_DIR_NAME)
+        self.datetime_data = _map_index_file(os.path.join(tools_dir, DATETIME_INDEX_FILENAME))
+        self.location_data = _map_index_file(os.path.join(tools_dir, LOCATION_INDEX_FILENAME))
+
+    def is_current(self):
+        """False if the journal changed since the index was built"""
+        try:
+            st = os.stat(self.journal_path)
+        except OSError:
+            return False
+        return (self.meta is not None and st.st_size == self.meta["journal_size"]
+                and st.st_mtime_ns == self.meta["journal_mtime_ns"])
+
+    def view(self, location=None):
+        """RecordView of all entries, or of one location's entries"""
+        if location is None:
+            return RecordView(self.datetime_data)
+        start, count, _ = self.meta["locations"].get(location.casefold(), [0, 0, ""])
+        return RecordView(self.location_data, start, count)
+
+    def read_lines(self, offsets):
+        lines = []
+        with open(self.journal_path, "rb") as f:
+            for offset in offsets:
+                f.seek(offset)
+                lines.append(f.readline().rstrip(b"\r\n").decode("utf-8"))
+        return lines
+
+    def close(self):
+        for data in (self.datetime_data, self.location_data):
+            if isinstance(data, mmap.mmap):
+                data.close()
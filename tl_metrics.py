@@ -0,0 +1,191 @@
+# run metrics shared by the TL_ scripts
+# 20261018 created. phase times, bytes, MB/s, file and filesystem call counts,
+#          saved as json in the tools folder, with optional cProfile output
+
+import time
+import threading
+import contextlib
+import cProfile
+import pstats
+import os
+from datetime import datetime
+from tl_common import get_tools_dir, save_tools_json
+
+
+class RunMetrics:
+    """Counters for one run of a tool.
+
+    phase() times a named part of the run, repeated use adds up.
+    Phases named "worker.*" are timed inside worker threads, so their time
+    is summed over the threads and can be more than the wall time.
+    counts hold file counts and fs_* filesystem call counts.
+    """
+
+    def __init__(self, tool_name):
+        self.tool_name = tool_name
+        self.started = datetime.now().isoformat(timespec="seconds")
+        self.start_time = time.perf_counter()
+        self.lock = threading.Lock()
+        self.phases = {}
+        self.counts = {}
+        self.bytes_read = 0
+        self.bytes_written = 0
+        # live rate over the last second or more, for progress lines
+        self.rate_sample = (self.start_time, 0, 0)
+        self.rate_text_last = ""
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def add_read(self, num_bytes):
+        with self.lock:
+            self.bytes_read += num_bytes
+
+    def add_written(self, num_bytes):
+        with self.lock:
+            self.bytes_written += num_bytes
+
+    def count(self, name, num=1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + num
+
+    def rate_text(self, files_done):
+        """', N files/s, N MB/s' since the last sample, for the end of a progress line"""
+        now = time.perf_counter()
+        with self.lock:
+            total_bytes = self.bytes_read + self.bytes_written
+        sample_time, sample_files, sample_bytes = self.rate_sample
+        elapsed = now - sample_time
+        if elapsed >= 1.0:
+            text = f", {(files_done - sample_files) / elapsed:.0f} files/s"
+            if total_bytes > sample_bytes:
+                text += f", {(total_bytes - sample_bytes) / 1e6 / elapsed:.1f} MB/s"
+            self.rate_text_last = text
+            self.rate_sample = (now, files_done, total_bytes)
+        return self.rate_text_last
+
+    def summary(self, counts=None):
+        elapsed = time.perf_counter() - self.start_time
+        with self.lock:
+            all_counts = dict(self.counts)
+            bytes_read = self.bytes_read
+            bytes_written = self.bytes_written
+            phases = {name: round(seconds, 3) for name, seconds in self.phases.items()}
+        all_counts.update(counts or {})
+        return {
+            "tool": self.tool_name,
+            "started": self.started,
+            "seconds": round(elapsed, 3),
+            "phases": phases,
+            "bytes_read": bytes_read,
+            "bytes_written": bytes_written,
+            "read_mb_per_s": round(bytes_read / 1e6 / elapsed, 2) if elapsed else 0,
+            "write_mb_per_s": round(bytes_written / 1e6 / elapsed, 2) if elapsed else 0,
+            "counts": all_counts,
+        }
+
+
+class ThreadProfiler:
+    """cProfile for the main thread and every thread started while enabled.
+    A plain cProfile.Profile only sees the thread that enabled it, and the
+    copy work runs on worker threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.profiles = []
+
+    def _start_thread_profile(self, *_):
+        # first profile event of a new thread: hand over to its own profiler
+        profile = cProfile.Profile()
+        with self.lock:
+            self.profiles.append(profile)
+        profile.enable()
+
+    def start(self):
+        threading.setprofile(self._start_thread_profile)
+        self._start_thread_profile()
+
+    def stop(self, output_path=None):
+        threading.setprofile(None)
+        with self.lock:
+            profiles = list(self.profiles)
+        profiles[0].disable()  # the main thread, the others have ended
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            try:
+                stats.add(profile)
+            except TypeError:
+                pass  # a thread that never ran any python code
+        if output_path:
+            stats.dump_stats(output_path)
+        return stats
+
+
+# the metrics of the running tool. a default is there so the shared
+# modules can count without checking if a run was started.
+current = RunMetrics("")
+profiler = None
+
+def start_run(tool_name, profile=False):
+    global current, profiler
+    current = RunMetrics(tool_name)
+    profiler = None
+    if profile:
+        profiler = ThreadProfiler()
+        profiler.start()
+    return current
+
+def phase(name):
+    return current.phase(name)
+
+def add_read(num_bytes):
+    current.add_read(num_bytes)
+
+def add_written(num_bytes):
+    current.add_written(num_bytes)
+
+def count(name, num=1):
+    current.count(name, num)
+
+def rate_text(files_done):
+    return current.rate_text(files_done)
+
+def finish_run(volume_root, counts=None):
+    """Print and save the run metrics, and the profile if one was taken.
+    counts are the tool's own result counts, added to the saved metrics.
+    """
+    global profiler
+    summary = current.summary(counts)
+    tool_name = current.tool_name
+    save_tools_json(volume_root, f"metrics_{tool_name}.json", summary)
+    print(f"\nRun time {summary['seconds']:.1f}s, read {summary['bytes_read'] / 1e6:.1f} MB"
+          f" ({summary['read_mb_per_s']} MB/s), written {summary['bytes_written'] / 1e6:.1f} MB"
+          f" ({summary['write_mb_per_s']} MB/s)")
+    for name, seconds in summary["phases"].items():
+        print(f" {name}: {seconds:.2f}s")
+    fs_counts = ", ".join(f"{name[3:]} {num}" for name, num in sorted(summary["counts"].items())
+                          if name.startswith("fs_"))
+    if fs_counts:
+        print(f" filesystem calls: {fs_counts}")
+
+    if profiler is not None:
+        try:
+            profile_path = os.path.join(get_tools_dir(volume_root), f"profile_{tool_name}.prof")
+        except OSError as e:
+            # read-only volume. the stats are still printed.
+            print(f"Warning: profile not saved: {e}")
+            profile_path = None
+        stats = profiler.stop(profile_path)
+        profiler = None
+        if profile_path:
+            print(f"\nProfile saved: {profile_path}")
+        stats.sort_stats("cumulative").print_stats(20)
+    return summary
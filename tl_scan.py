@@ -0,0 +1,93 @@
+# collection scanner shared by the TL_ scripts
+# 20261018 replaces the get_collection_files copies in each script
+# 20261018 added FolderNamespace for resolving name collisions in memory
+# 20261018 directory reads and stats are counted in the run metrics
+# 20261018 FolderNamespace ignores case on every OS, FAT/exFAT cards do too
+
+import os
+from collections import namedtuple
+import tl_metrics
+
+# relpath is relative to the collection root, with os separators.
+# size and mtime_ns come from the directory scan, no extra stat needed.
+CollectionFile = namedtuple("CollectionFile", ["relpath", "path", "size", "mtime_ns"])
+
+def is_excluded_folder(folder_name):
+    """Root folders that are not part of the collection"""
+    return folder_name.startswith('_') or folder_name.startswith('System Volume')
+
+def list_collection_folders(root_path):
+    """DirEntry of each collection folder in the root (excluding root files and _* root dirs)"""
+    tl_metrics.count("fs_scandir")
+    with os.scandir(str(root_path)) as it:
+        for entry in it:
+            if entry.is_dir() and not is_excluded_folder(entry.name):
+                yield entry
+
+def scan_folder(folder_path, relfolder):
+    """Yield a CollectionFile for each file in a folder and its subfolders, in directory order"""
+    tl_metrics.count("fs_scandir")
+    with os.scandir(folder_path) as it:
+        subfolders = []
+        for entry in it:
+            relpath = os.path.join(relfolder, entry.name)
+            if entry.is_file():
+                st = entry.stat()
+                tl_metrics.count("fs_stat")
+                yield CollectionFile(relpath, entry.path, st.st_size, st.st_mtime_ns)
+            elif entry.is_dir():
+                subfolders.append((entry.path, relpath))
+    # top level folders should have no subfolders, but dont lose files if they do
+    for sub_path, sub_relpath in subfolders:
+        yield from scan_folder(sub_path, sub_relpath)
+
+def scan_collection(root_path):
+    """Yield a CollectionFile for every file in the collection folders of a volume"""
+    for folder_entry in list_collection_folders(root_path):
+        yield from scan_folder(folder_entry.path, folder_entry.name)
+
+def list_folder_entries(folder_path):
+    """DirEntry of everything directly in a folder, from one directory read"""
+    tl_metrics.count("fs_scandir")
+    with os.scandir(str(folder_path)) as it:
+        return list(it)
+
+
+class FolderNamespace:
+    """The names in one folder, listed once then kept up to date in memory.
+
+    Collisions and _N suffixes are resolved against this set instead of an
+    exists() call per candidate, which is a slow lookup on FAT/exFAT cards.
+    Names compare casefolded on every OS. FAT/exFAT cards and default macOS
+    volumes ignore case on linux and macOS too, and a rename onto a name
+    that differs only in case would replace that file without an error.
+    """
+
+    def __init__(self, folder_path, names=None):
+        self.folder_path = str(folder_path)
+        if names is None:
+            try:
+                tl_metrics.count("fs_scandir")
+                names = os.listdir(self.folder_path)
+            except FileNotFoundError:
+                names = []
+        self.names = set(name.casefold() for name in names)
+
+    def exists(self, name):
+        return name.casefold() in self.names
+
+    def add(self, name):
+        self.names.add(name.casefold())
+
+    def remove(self, name):
+        self.names.discard(name.casefold())
+
+    def unique_name(self, filename, suffix_sep="_"):
+        """filename, or base{suffix_sep}N.ext with the first free N"""
+        base, ext = os.path.splitext(filename)
+        candidate = filename
+        counter = 1
+        while self.exists(candidate):
+            candidate = f"{base}{suffix_sep}{counter}{ext}"
+            counter += 1
+        return candidate